@@ -1,16 +1,18 @@
+import shutil
 from pathlib import Path
-# from pipeline.parse_pdf import parse_pdf_to_markdown
 from pipeline.summarize_with_deepseek import summarize_markdown
-from pipeline.summarize_with_qwen_long import upload_and_summarize_pdf
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from pipeline.summarize_with_qwen_long import upload_and_summarize_pdf, summarize_pdfs_async
+from concurrent.futures import as_completed
+from utils.concurrency import AdaptiveExecutor
 from pipeline.run_embedding_qwen import run_embedding_on_folder
+from research_pipeline.vector_index import update_index
+from pipeline.streaming_ingest import run_streaming_ingest
+from pipeline.magic_pdf_runner import run_magic_pdf_batch, MAGIC_PDF_WORKERS, MAGIC_PDF_TIMEOUT
+from utils import job_ledger
 
 from dotenv import load_dotenv
 from log_init import setup_logger 
 from prompts import pdf_analyse_prompts
-import subprocess
-import shutil
-import os
 
 path_liter = Path("liter_source")       # 文档目录
 path_markdown = Path("markdown_out")    # MD目录
@@ -20,6 +22,11 @@ path_embedding_qwen  = Path("embedding_qwen_long") # embedding目录
 load_dotenv()
 logger = setup_logger(__name__)  # 初始化log信息
 
+def _tracked(name: str, stage: str, fn, *args, **kwargs):
+    """在台账中记录 fn 的执行（供线程池提交）"""
+    with job_ledger.track(name, stage):
+        return fn(*args, **kwargs)
+
 def ensure_dir(path: Path):
     """
     确保指定路径的目录存在，如果不存在则创建该目录及其所有必要的父目录。
@@ -28,15 +35,21 @@ def ensure_dir(path: Path):
     """
     path.mkdir(parents=True, exist_ok=True)
 
-def run_stage1_pdf_to_md():
+def run_stage1_pdf_to_md(regenerate: bool = False):
     """
     ===调用多模态api时不运行该函数===
     执行第一阶段的PDF到Markdown转换处理流程
     
     该函数遍历源目录中的所有PDF文件，将每个PDF文件转换为Markdown格式，
     并将结果保存到对应的输出目录中。如果输出目录已存在，则跳过该文件的处理。
-        
+
+    参数:
+        regenerate (bool): 为 True 时已处理过的文件也重新生成 Markdown；
+                           各页 OCR 结果已缓存（见 utils/ocr_cache.py），只重新执行后处理
     """
+    # 在函数内导入：PaddleOCR / OpenCV 只有本地 OCR 流程需要，其他流程不必安装
+    from pipeline.parse_pdf import parse_pdf_to_markdown
+
     src_dir = path_liter
     out_dir = path_markdown
     ensure_dir(out_dir)
@@ -44,11 +57,12 @@ def run_stage1_pdf_to_md():
     for pdf in src_dir.glob("*.pdf"):
         folder_name = pdf.stem
         target_folder = out_dir / folder_name
-        if target_folder.exists():
+        if target_folder.exists() and not regenerate:
             logger.warning(f"[跳过] 已处理过：{folder_name}")
             continue
 
         logger.info(f"[STEP 1] 处理 PDF → Markdown: {folder_name}")
+        existed = target_folder.exists()
         ensure_dir(target_folder)
 
         # 生成 config dict
@@ -63,18 +77,25 @@ def run_stage1_pdf_to_md():
             "save_visual": False
         }
 
-        # parse_pdf_to_markdown(config)
+        try:
+            parse_pdf_to_markdown(config)
+        except Exception as e:
+            logger.error(f"[错误] 处理 {pdf.name} 时异常：{e}")
+            if not existed:
+                shutil.rmtree(target_folder, ignore_errors=True)  # 删除不完整的输出，下次运行时重新处理
         
-def run_stage1_pdf_to_md_magic_pdf():
+def run_stage1_pdf_to_md_magic_pdf(max_workers: int = MAGIC_PDF_WORKERS, timeout: float = MAGIC_PDF_TIMEOUT):
     """
     ===调用多模态api格式时不运行该函数===
     将 source_dir 中的所有 PDF 文件通过 magic-pdf 工具转换为 Markdown 格式，并将结果保存到 output_dir。
 
-    该函数会遍历 liter_source 目录下的所有 .pdf 文件，使用 magic-pdf 命令行工具将其转换为 Markdown，
-    并对输出文件结构进行整理，将嵌套目录中的内容提取到目标文件夹中。
+    该函数会遍历 liter_source 目录下的所有 .pdf 文件，并行调用 magic-pdf 命令行工具将其转换为 Markdown，
+    并对输出文件结构进行整理，将嵌套目录中的内容移动到目标文件夹中（见 pipeline/magic_pdf_runner.py）。
 
     参数:
-        无显式参数，依赖于硬编码的路径：
+        max_workers (int): 同时运行的 magic-pdf 进程数
+        timeout (float): 单个 PDF 的超时时间（秒）
+        依赖于硬编码的路径：
             - source_dir: 源 PDF 文件所在目录（"liter_source"）
             - output_dir: 转换后 Markdown 文件的输出目录（"markdown_out"）
 
@@ -84,8 +105,8 @@ def run_stage1_pdf_to_md_magic_pdf():
     注意事项:
         - 若目标 Markdown 文件已存在，则跳过处理；
         - 需确保系统中已安装并可调用 magic-pdf 命令；
-        - 函数依赖 logger、subprocess、shutil 等模块完成日志记录与文件操作；
-        - 处理过程中若出错，将记录错误信息但不会中断整个流程；
+        - 每个 PDF 的 magic-pdf 输出写入 .cache/magic_pdf_logs/<文件名>.log；
+        - 处理过程中若出错或超时，将记录错误信息但不会中断整个流程；
     """
     source_dir = Path("liter_source")
     output_dir = Path("markdown_out")
@@ -93,6 +114,7 @@ def run_stage1_pdf_to_md_magic_pdf():
     pdf_files = list(source_dir.glob("*.pdf"))
     logger.info(f"[MagicPDF] 检测到 {len(pdf_files)} 个PDF文件...")  # 使用 logger 替代 print
 
+    jobs = []
     for pdf_path in pdf_files:
         pdf_stem = pdf_path.stem
         target_dir = output_dir / pdf_stem
@@ -101,42 +123,11 @@ def run_stage1_pdf_to_md_magic_pdf():
         if final_md_path.exists():
             logger.warning(f"[MagicPDF] 已存在，跳过：{final_md_path}")
             continue
+        jobs.append((pdf_path, target_dir))
 
-        target_dir.mkdir(parents=True, exist_ok=True)
-
-        cmd = [
-            "magic-pdf",
-            "-p", str(pdf_path),
-            "--output-dir", str(target_dir)
-        ]
-
-        logger.info(f"[MagicPDF] 处理中：{pdf_path.name}")
-        try:
-            subprocess.run(cmd, check=True)
-            logger.info(f"[MagicPDF] ✅ 处理完成，开始整理文件结构...")
-
-            # 获取magic-pdf嵌套路径
-            nested_auto_dir = target_dir / pdf_stem / "auto"
-            if not nested_auto_dir.exists():
-                logger.warning(f"[MagicPDF] ⚠ 未找到预期的输出目录：{nested_auto_dir}")
-                continue
-
-            # 遍历并复制 auto/ 下的所有内容
-            for item in nested_auto_dir.iterdir():
-                dest_path = target_dir / item.name
-                if item.is_file():
-                    shutil.copy2(item, dest_path)
-                elif item.is_dir():
-                    dest_path.mkdir(exist_ok=True)
-                    for subitem in item.iterdir():
-                        shutil.copy2(subitem, dest_path / subitem.name)
-                        
-            shutil.rmtree(target_dir / pdf_stem)  # 复制后删除原auto目录
-            logger.info(f"[MagicPDF] ✅ 文件整理完成：{pdf_stem}")
-
-        except subprocess.CalledProcessError as e:
-            logger.error(f"[MagicPDF] ❌ 处理失败：{pdf_path.name}")
-            logger.error(e)
+    logger.info(f"[MagicPDF] 待处理 {len(jobs)} 个，并发数 {max_workers}")
+    stats = run_magic_pdf_batch(jobs, max_workers, timeout)
+    logger.info(f"[MagicPDF] ✅ 全部结束：成功 {stats['done']} 个，失败 {stats['failed']} 个")
 
 def run_stage2_md_to_summary():
     """
@@ -157,10 +148,10 @@ def run_stage2_md_to_summary():
     """
     markdown_root = path_markdown
     summary_root = path_embedding
-    max_workers = 8  # 可根据 CPU 核心和网络能力调整
+    unfinished_names = set(job_ledger.unfinished(job_ledger.STAGE_SUMMARIZE_MD))
 
     tasks = []
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    with AdaptiveExecutor("deepseek", workload="md_summary") as executor:  # 并发数按 DeepSeek 的响应与限流情况自动调节
         for subdir in markdown_root.iterdir():
             if not subdir.is_dir():
                 continue
@@ -170,7 +161,8 @@ def run_stage2_md_to_summary():
                 continue
 
             target_dir = summary_root / subdir.name
-            if target_dir.exists():
+            # 目录存在且台账中没有未完成 / 失败记录时跳过（中途中断的任务重新执行）
+            if target_dir.exists() and subdir.name not in unfinished_names:
                 logger.warning(f"[跳过] 已存在总结目录：{target_dir}")
                 continue
 
@@ -185,7 +177,7 @@ def run_stage2_md_to_summary():
 
             logger.info(f"[提交] 总结任务：{md_file}")
             tasks.append(
-                executor.submit(summarize_markdown, str(md_file), summarize_cfg)
+                executor.submit(_tracked, subdir.name, job_ledger.STAGE_SUMMARIZE_MD, summarize_markdown, str(md_file), summarize_cfg)
             )
 
         for future in as_completed(tasks):
@@ -196,44 +188,73 @@ def run_stage2_md_to_summary():
                 logger.error(f"[错误] 总结失败：{e}")
 
 
-def run_stage12_pdf_to_summary():
+def collect_stage12_tasks():
     """
-    执行PDF文档摘要生成任务
-    
-    该函数遍历指定目录中的所有PDF文件，对未处理过的PDF文件进行摘要生成，
-    并将结果保存到对应的目标目录中。使用多线程并发处理提高效率。
-    
-    参数:
-        无
-        
+    获取所有未处理（目标目录中没有 summary.md）的 PDF 文件
+
     返回值:
-        无
-        
-    注意:
-        - 只处理目标目录中不存在summary.md文件的PDF
-        - 最大线程数根据I/O绑定任务特性设置为8
-        - 使用ThreadPoolExecutor进行并发处理
+        list: [(pdf_path, target_dir)]
     """
     source_dir = path_liter
     target_root = path_embedding_qwen
-    prompt = pdf_analyse_prompts
-    task_num = 8 # 设置最大线程数（你有20线程，但I/O绑定任务建议使用8-12个）
-    
-    # 获取所有未处理的 PDF 文件
+
+    # 台账中总结阶段中断（running）或失败的论文，即使 summary.md 存在也重新处理
+    unfinished_names = set(job_ledger.unfinished(job_ledger.STAGE_SUMMARIZE))
     tasks = []
     for pdf_path in source_dir.glob("*.pdf"):
         pdf_name = pdf_path.stem
         target_dir = target_root / pdf_name
-        if (target_dir / "summary.md").exists():
+        if (target_dir / "summary.md").exists() and pdf_name not in unfinished_names:
             # logger.warning(f"[跳过] {pdf_name} 已存在摘要，跳过处理。")
             continue
         tasks.append((pdf_path, target_dir))
 
     logger.info(f"[计划处理] 共需处理 {len(tasks)} 个 PDF 文件。\n")
+    return tasks
+
+
+def run_stage123_streaming():
+    """
+    总结、向量化、索引三阶段重叠执行（见 pipeline/streaming_ingest.py）
+
+    每篇 summary.md 写出后立即向量化并进入检索索引，无需等待全部 PDF 总结完成；
+    索引只由流程内的索引线程写入（结束时的最后一次同步会纳入手工增删的论文）。
+    """
+    ensure_dir(path_embedding_qwen)
+    run_streaming_ingest(collect_stage12_tasks(), path_embedding_qwen, pdf_analyse_prompts)
+
+
+def run_stage12_pdf_to_summary(use_async: bool = True):
+    """
+    执行PDF文档摘要生成任务
+    
+    该函数遍历指定目录中的所有PDF文件，对未处理过的PDF文件进行摘要生成，
+    并将结果保存到对应的目标目录中。
+    
+    参数:
+        use_async (bool): True 时使用 asyncio 流水线（上传 / 等待解析 / 流式总结分别限流，
+                          等待解析的文件不占线程）；False 时使用线程池逐个执行
+        
+    返回值:
+        无
+        
+    注意:
+        - 只处理目标目录中不存在summary.md文件的PDF
+        - 线程池模式使用AdaptiveExecutor，并发数按服务端延迟与限流情况自动调节
+    """
+    prompt = pdf_analyse_prompts
+    tasks = collect_stage12_tasks()
 
-    max_workers = min(task_num, os.cpu_count()) # type: ignore
+    if use_async:
+        results = summarize_pdfs_async(tasks, prompt)
+        for pdf_name, error in results.items():
+            if error is None:
+                logger.info(f"[完成] {pdf_name} 摘要生成成功。\n")
+            else:
+                logger.error(f"[错误] 处理 {pdf_name} 时出错：{error}\n")
+        return
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    with AdaptiveExecutor("qwen", workload="pdf_summary") as executor:
         futures = {
             executor.submit(upload_and_summarize_pdf, pdf_path, target_dir, prompt): pdf_path.name
             for pdf_path, target_dir in tasks
@@ -248,12 +269,23 @@ def run_stage12_pdf_to_summary():
                 logger.error(f"[错误] 处理 {pdf_name} 时出错：{e}\n")
 
 
+def run_stage3_embedding():
+    """
+    非流式流程的第三阶段：总结全部完成后统一向量化，再增量同步检索用向量索引
+
+    流式流程（run_stage123_streaming）已包含这两步，无需再调用。
+    """
+    run_embedding_on_folder(path_embedding_qwen)
+    update_index(path_embedding_qwen)  # 只处理新增/变化/删除的论文
+
+
 def main():
     # run_stage1_pdf_to_md() #使用基础OCR
     # run_stage1_pdf_to_md_magic_pdf()  # 使用 magic-pdf
     # run_stage2_md_to_summary() #使用 Deepseek 进行信息压缩
-    run_stage12_pdf_to_summary() #使用 Qwen long 进行pdf信息压缩
-    run_embedding_on_folder(path_embedding_qwen) #使用 Qwen embeddingv3模型对每个知识点语义向量化处理
+    # run_stage12_pdf_to_summary() #使用 Qwen long 进行pdf信息压缩
+    # run_stage3_embedding() #使用 Qwen embeddingv3模型对每个知识点语义向量化处理，并同步检索索引
+    run_stage123_streaming() #流式执行：每篇摘要写出后立即向量化并写入检索索引
     
 if __name__ == "__main__":
     main()
@@ -0,0 +1,102 @@
+# pipeline/benchmark_bgem3.py
+"""
+BGE-M3 本地推理微基准
+
+对比 fp32 与 int8 快速模式的单条查询延迟与批量吞吐，并校验 int8 输出与 fp32 的余弦相似度。
+
+用法:
+    python -m pipeline.benchmark_bgem3 --threads 8 --batch-size 10 --rounds 5
+    python -m pipeline.benchmark_bgem3 --sample-dir embedding_qwen_long  # 使用真实 summary.md 段落
+"""
+
+import re
+import time
+import argparse
+import numpy as np
+from pathlib import Path
+from typing import List, Optional
+
+from pipeline import get_embedding_bgem3 as bgem3
+
+# 没有真实样本时使用的合成段落：长度接近"技术要点"段落
+_SAMPLE = (
+    "## 技术要点 1\n### 技术名称\n低轨卫星多波束干扰抑制\n### 技术原理\n"
+    "采用基于空间相关矩阵的自适应波束赋形，通过最小化输出干扰加噪声功率求解加权向量 $w = R^{-1}a / (a^H R^{-1} a)$，"
+    "在保持期望方向增益的同时对干扰方向形成零陷。"
+)
+
+
+def load_sample_chunks(sample_dir: Optional[str], n: int) -> List[str]:
+    """从文献库的 summary.md 中按"技术要点"切分取前 n 段；没有样本时返回合成段落"""
+    chunks = []
+    if sample_dir:
+        for md_path in sorted(Path(sample_dir).glob("*/summary.md")):
+            text = md_path.read_text(encoding="utf-8")
+            chunks += [c for c in re.split(r"(?=^##\s*技术要点)", text, flags=re.MULTILINE)[1:] if c.strip()]
+            if len(chunks) >= n:
+                break
+    if not chunks:
+        chunks = [_SAMPLE * (1 + i % 4) for i in range(n)]
+    return chunks[:n]
+
+
+def _measure(fn, rounds: int) -> List[float]:
+    latencies = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+    return latencies
+
+
+def run_benchmark(chunks: List[str], batch_size: int = 10, rounds: int = 5, threshold: float = bgem3.INT8_MIN_COSINE) -> dict:
+    """
+    分别测量两种模式的单条查询延迟（p50）与批量吞吐（条/秒），并做 int8 精度校验
+
+    参数:
+        chunks (List[str]): 测试文本，batch_size 条一批
+        batch_size (int): 批量吞吐测试的批大小（默认 10，对应一篇论文的最多段落数）
+        rounds (int): 每项重复次数
+        threshold (float): int8 精度校验的余弦相似度下限
+    """
+    batch = chunks[:batch_size]
+    report = {"threads": bgem3.NUM_THREADS or "default", "batch_size": len(batch), "modes": {}}
+    for mode, fast in (("fp32", False), ("int8", True)):
+        t0 = time.perf_counter()
+        bgem3.warmup(fast=fast)
+        load_s = time.perf_counter() - t0
+
+        query_lat = _measure(lambda: bgem3.get_embedding_bge_m3(batch[0][:64], fast=fast), rounds)
+        batch_lat = _measure(lambda: bgem3.get_embedding_bge_m3(batch, fast=fast), rounds)
+        report["modes"][mode] = {
+            "load_s": load_s,
+            "query_p50_ms": float(np.median(query_lat) * 1000),
+            "batch_p50_ms": float(np.median(batch_lat) * 1000),
+            "throughput_per_s": len(batch) / float(np.median(batch_lat)),
+        }
+    report["accuracy"] = bgem3.check_int8_accuracy(batch, threshold)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BGE-M3 本地推理微基准")
+    parser.add_argument("--threads", type=int, default=0, help="推理线程数，0 为 torch 默认")
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=bgem3.INT8_MIN_COSINE)
+    parser.add_argument("--sample-dir", help="文献库目录，从其 summary.md 中取测试段落")
+    args = parser.parse_args()
+
+    bgem3.NUM_THREADS = args.threads
+    report = run_benchmark(load_sample_chunks(args.sample_dir, args.batch_size), args.batch_size, args.rounds, args.threshold)
+
+    print(f"\n📊 BGE-M3 CPU 推理（线程数 {report['threads']}，批大小 {report['batch_size']}）\n")
+    for mode, r in report["modes"].items():
+        print(f"- {mode}: 加载 {r['load_s']:.1f}s | 单条查询 {r['query_p50_ms']:.0f}ms | "
+              f"整批 {r['batch_p50_ms']:.0f}ms | 吞吐 {r['throughput_per_s']:.1f} 条/秒")
+    fp32, int8 = report["modes"]["fp32"], report["modes"]["int8"]
+    print(f"\n  int8 加速：单条 {fp32['query_p50_ms'] / int8['query_p50_ms']:.2f}x | "
+          f"吞吐 {int8['throughput_per_s'] / fp32['throughput_per_s']:.2f}x")
+    acc = report["accuracy"]
+    flag = "✅" if acc["passed"] else "❌"
+    print(f"\n{flag} int8 与 fp32 余弦相似度：最小 {acc['min_cosine']:.4f} / 平均 {acc['mean_cosine']:.4f}（下限 {acc['threshold']}）\n")
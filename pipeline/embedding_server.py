@@ -0,0 +1,218 @@
+# pipeline/embedding_server.py
+"""
+本地 BGE-M3 共享向量服务
+
+一台机器上只加载一份 BGE-M3 模型，Streamlit、入库流程与临时脚本都通过 localhost HTTP 调用，
+避免每个进程各持一份模型（约 4.5GB）导致内存不足。
+
+服务端把并发到达的小请求合并成微批次：第一个请求到达后最多等待 max_wait_ms，
+或凑满 max_batch 条文本即执行一次前向推理，再把结果按请求拆分返回。
+
+启动服务:
+    python -m pipeline.embedding_server --port 8765
+
+客户端:
+    get_embedding_from_server(["文本1", "文本2"])  # 服务地址取环境变量 EMBEDDING_SERVER_URL
+"""
+
+import os
+import json
+import queue
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+from log_init import setup_logger
+from utils.api_clients import get_http_session
+from pipeline import get_embedding_bgem3 as bgem3
+from pipeline.get_embedding_bgem3 import get_embedding_bge_m3, warmup
+
+logger = setup_logger(__name__)  # 初始化log信息
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_URL = f"http://{DEFAULT_HOST}:{DEFAULT_PORT}"
+MAX_BATCH = 32        # 单次前向推理的最大文本条数
+MAX_WAIT_MS = 10      # 第一个请求到达后等待其他请求合并的最长时间
+REQUEST_TIMEOUT = 300 # 客户端等待单个请求的超时（秒），大批量入库时推理可能较慢
+
+
+class _Request:
+    """一次客户端请求：待编码文本与结果回传"""
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.done = threading.Event()
+        self.embeddings = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    动态微批次调度器
+
+    所有请求进入同一队列，由单个工作线程合并后调用模型：
+    取到第一个请求后，在 max_wait_ms 内继续收集，直到文本数达到 max_batch 为止。
+    单个请求的文本数超过 max_batch 时按原样单独成批（模型侧仍一次前向）。
+    """
+
+    def __init__(self, max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._pending = None
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, texts: List[str]) -> List[List[float]]:
+        """提交文本并阻塞等待结果"""
+        req = _Request(texts)
+        self._queue.put(req)
+        req.done.wait()
+        if req.error is not None:
+            raise req.error
+        return req.embeddings # type: ignore
+
+    def _collect(self) -> List[_Request]:
+        # 上一轮放不下的请求优先进入本轮
+        first, self._pending = (self._pending, None) if self._pending else (self._queue.get(), None)
+        batch = [first]
+        size = len(first.texts)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                req = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if size + len(req.texts) > self.max_batch:
+                self._pending = req
+                break
+            batch.append(req)
+            size += len(req.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for req in batch for text in req.texts]
+            try:
+                vectors = get_embedding_bge_m3(texts).cpu().tolist()
+                offset = 0
+                for req in batch:
+                    req.embeddings = vectors[offset:offset + len(req.texts)]
+                    offset += len(req.texts)
+            except Exception as e:
+                logger.error(f"[Embedding服务] 推理失败（{len(texts)} 条文本）：{e}")
+                for req in batch:
+                    req.error = e
+            for req in batch:
+                req.done.set()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    batcher: MicroBatcher
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/embed":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            texts = json.loads(self.rfile.read(length))["texts"]
+            if isinstance(texts, str):
+                texts = [texts]
+        except Exception as e:
+            self._send_json(400, {"error": f"invalid request: {e}"})
+            return
+        if not texts:
+            self._send_json(200, {"embeddings": []})
+            return
+        try:
+            self._send_json(200, {"embeddings": self.batcher.submit(texts)})
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+
+    def log_message(self, format, *args):
+        pass  # 关闭逐请求的访问日志
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # 默认监听队列仅 5，并发客户端较多时连接会被拒绝
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+          max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS):
+    """
+    启动向量服务（阻塞运行）
+
+    参数:
+        host (str): 监听地址，默认只监听本机
+        port (int): 监听端口
+        max_batch (int): 单次前向推理的最大文本条数
+        max_wait_ms (float): 合并请求的最长等待时间（毫秒）
+    """
+    logger.info("[Embedding服务] 正在加载 BGE-M3 模型...")
+    warmup()
+    _Handler.batcher = MicroBatcher(max_batch, max_wait_ms)
+    server = _Server((host, port), _Handler)
+    logger.info(f"[Embedding服务] 已启动：http://{host}:{port}（批大小 {max_batch}，最长等待 {max_wait_ms}ms）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def get_embedding_from_server(texts) -> List[List[float]]:
+    """
+    通过本地向量服务获取 BGE-M3 向量
+
+    参数:
+        texts (str or list): 输入的文本字符串或文本列表
+
+    返回:
+        list: 归一化后的向量列表，与输入文本一一对应
+    """
+    if isinstance(texts, str):
+        texts = [texts]
+    url = os.getenv("EMBEDDING_SERVER_URL", DEFAULT_URL).rstrip("/") + "/embed"
+    # 共享会话复用 keep-alive 连接，并发向量化时不必每批重新建立 TCP 连接
+    response = get_http_session("embedding_server").post(url, json={"texts": texts}, timeout=REQUEST_TIMEOUT)
+    if response.status_code != 200:
+        raise RuntimeError(f"向量服务返回错误 {response.status_code}: {response.text}")
+    return response.json()["embeddings"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地 BGE-M3 共享向量服务")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    parser.add_argument("--fast", action="store_true", help="使用 int8 动态量化的快速推理模式")
+    parser.add_argument("--threads", type=int, default=0, help="推理线程数，0 为 torch 默认")
+    args = parser.parse_args()
+    bgem3.FAST_MODE = args.fast or bgem3.FAST_MODE
+    bgem3.NUM_THREADS = args.threads or bgem3.NUM_THREADS
+    serve(args.host, args.port, args.max_batch, args.max_wait_ms)
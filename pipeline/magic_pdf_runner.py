@@ -0,0 +1,131 @@
+# pipeline/magic_pdf_runner.py
+"""
+magic-pdf 并行调度
+
+多个 magic-pdf 子进程并行转换（并发数可配置），每个任务有超时限制，输出写入独立日志文件；
+转换完成后用同一文件系统内的重命名（os.replace）把 <stem>/auto/ 下的内容移到目标目录，
+不再复制后删除（每个文件只写一次）。
+"""
+
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from log_init import setup_logger
+
+logger = setup_logger(__name__)  # 初始化log信息
+
+MAGIC_PDF_WORKERS = 2      # 同时运行的 magic-pdf 进程数（每个进程各自加载模型，按显存 / 内存调整）
+MAGIC_PDF_TIMEOUT = 1800   # 单个 PDF 的最长转换时间（秒），超时的进程被终止
+LOG_DIR = Path(".cache") / "magic_pdf_logs"  # 每个 PDF 一个日志文件：<stem>.log
+
+
+def _move(src: Path, dest: Path):
+    """
+    用 os.replace 把 src 移到 dest：两者都是目录时逐项合并；
+    dest 是类型不同的残留（上次中断留下的同名文件 / 目录）时先删除再移动
+    """
+    if src.is_dir() and dest.is_dir():
+        for item in src.iterdir():
+            _move(item, dest / item.name)
+        return
+    if dest.is_dir() != src.is_dir() and (dest.exists() or dest.is_symlink()):
+        logger.warning(f"[MagicPDF] 删除与新输出类型不同的残留：{dest}")
+        if dest.is_dir() and not dest.is_symlink():
+            shutil.rmtree(dest)
+        else:
+            dest.unlink()
+    os.replace(src, dest)
+
+
+def flatten_output(target_dir: Path, pdf_stem: str) -> bool:
+    """
+    将 magic-pdf 的嵌套输出 <target_dir>/<stem>/auto/ 移动到 target_dir 下并删除空的嵌套目录
+
+    返回:
+        bool: 未找到嵌套输出目录时返回 False
+    """
+    nested_root = target_dir / pdf_stem
+    nested_auto_dir = nested_root / "auto"
+    if not nested_auto_dir.exists():
+        return False
+
+    for item in nested_auto_dir.iterdir():
+        # 目标目录已存在（如上次中断残留的 images/）时逐个移入
+        _move(item, target_dir / item.name)
+
+    shutil.rmtree(nested_root)  # 此时只剩空目录
+    return True
+
+
+def run_magic_pdf(pdf_path: Path, target_dir: Path, timeout: float = MAGIC_PDF_TIMEOUT) -> Tuple[bool, str]:
+    """
+    转换单个 PDF 并整理输出
+
+    参数:
+        pdf_path (Path): 源 PDF
+        target_dir (Path): 输出目录（<output_dir>/<stem>）
+        timeout (float): 超时时间（秒）
+
+    返回:
+        (是否成功, 说明信息)
+    """
+    pdf_stem = pdf_path.stem
+    target_dir.mkdir(parents=True, exist_ok=True)
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    log_path = LOG_DIR / f"{pdf_stem}.log"
+
+    cmd = [
+        "magic-pdf",
+        "-p", str(pdf_path),
+        "--output-dir", str(target_dir)
+    ]
+
+    try:
+        with open(log_path, "w", encoding="utf-8") as log_file:
+            subprocess.run(cmd, stdout=log_file, stderr=subprocess.STDOUT, timeout=timeout, check=True)
+    except subprocess.TimeoutExpired:
+        shutil.rmtree(target_dir / pdf_stem, ignore_errors=True)  # 清理不完整的输出，下次重新转换
+        return False, f"超时（>{timeout:.0f}s），日志：{log_path}"
+    except subprocess.CalledProcessError as e:
+        shutil.rmtree(target_dir / pdf_stem, ignore_errors=True)
+        return False, f"退出码 {e.returncode}，日志：{log_path}"
+
+    if not flatten_output(target_dir, pdf_stem):
+        return False, f"未找到预期的输出目录：{target_dir / pdf_stem / 'auto'}"
+    return True, "完成"
+
+
+def run_magic_pdf_batch(jobs: List[Tuple[Path, Path]], max_workers: int = MAGIC_PDF_WORKERS,
+                        timeout: float = MAGIC_PDF_TIMEOUT) -> dict:
+    """
+    并行转换多个 PDF
+
+    参数:
+        jobs (list): [(pdf_path, target_dir)]
+        max_workers (int): 同时运行的 magic-pdf 进程数
+        timeout (float): 单个任务的超时时间（秒）
+
+    返回:
+        dict: {"done": 成功数, "failed": 失败数}
+    """
+    stats = {"done": 0, "failed": 0}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:  # 线程只负责等待子进程
+        futures = {executor.submit(run_magic_pdf, pdf_path, target_dir, timeout): pdf_path
+                   for pdf_path, target_dir in jobs}
+        for future in as_completed(futures):
+            pdf_path = futures[future]
+            try:
+                ok, msg = future.result()
+            except Exception as e:
+                ok, msg = False, str(e)
+            if ok:
+                stats["done"] += 1
+                logger.info(f"[MagicPDF] ✅ {pdf_path.name} 处理完成（{stats['done'] + stats['failed']}/{len(jobs)}）")
+            else:
+                stats["failed"] += 1
+                logger.error(f"[MagicPDF] ❌ 处理失败：{pdf_path.name}，{msg}")
+    return stats
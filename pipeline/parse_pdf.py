@@ -1,98 +1,328 @@
+import os
+import re
 import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import cv2
 import numpy as np
 from pathlib import Path
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 from paddleocr import PPStructure, draw_structure_result # type: ignore
 from utils.table_utils import html_table_to_markdown
 from utils.text_utils import clean_text, auto_title_format, smart_paragraph_split
+from utils.file_registry import file_sha256
+from utils import ocr_cache
+from log_init import setup_logger
 
+try:
+    import fitz  # PyMuPDF（见 requirements.txt）：直接读取 PDF 文本层，未安装时全部页面走 OCR
+except ImportError:
+    fitz = None
 
-def parse_pdf_to_markdown(config: dict) -> str:
+logger = setup_logger(__name__)  # 初始化log信息
 
-    pdf_path = config["pdf_path"]
-    output_dir = Path(config["output_dir"])
-    output_dir.mkdir(exist_ok=True, parents=True)
+PAGE_DPI = 300
+OCR_WORKERS = max(1, (os.cpu_count() or 1) // 2)  # 页面并行的进程数，可由 config["workers"] 覆盖；1 为单进程逐页处理
+PAGE_WINDOW = 4  # 单进程模式每次栅格化的页数，峰值内存约为 PAGE_WINDOW 页位图（与总页数无关）
 
-    ocr_engine = PPStructure(
-        layout=config.get("layout_analysis", True),
-        table=config.get("table", True),
-        ocr=config.get("ocr_order", True),
-        lang=config.get("lang", "ch")
-    )
+# 文本层提取（config["text_layer"]：True-有可用文本层的页直接提取，只对扫描页 / 以图为主的页做 OCR；False-全部 OCR）
+MIN_PAGE_CHARS = 50           # 文本层有效字符数低于该值视为扫描页
+MIN_VALID_CHAR_RATIO = 0.85   # 中文 / 字母数字 / 常见标点占比低于该值视为乱码（字体编码缺失）
+MAX_IMAGE_AREA_RATIO = 0.5    # 图片面积占页面比例超过该值（以图为主）时改用 OCR
+HEADER_FOOTER_MARGIN = 0.06   # 完全落在页面上下该比例范围内的文本块视为页眉 / 页脚
+TITLE_SIZE_RATIO = 1.15       # 字号超过正文字号（页内中位数）该倍数的短文本块视为标题
+TITLE_MAX_CHARS = 60
+_VALID_CHAR = re.compile(r"[\u4e00-\u9fff\u3000-\u303f\uff00-\uffefA-Za-z0-9\s.,;:!?()\[\]{}%+\-*/=<>'\"·—–…]")
 
-    images = convert_from_path(pdf_path, dpi=300)
-    md_lines = []
-    seen_paragraphs = set()
+_fitz_warned = False   # 未安装 PyMuPDF 的警告每个进程只输出一次
+_engine = None         # 当前进程的 PPStructure 引擎（每个进程只初始化一次）
+_engine_kwargs = None
+
+
+def _build_engine_kwargs(config: dict, cpu_threads: int) -> dict:
+    return {
+        "layout": config.get("layout_analysis", True),
+        "table": config.get("table", True),
+        "ocr": config.get("ocr_order", True),
+        "lang": config.get("lang", "ch"),
+        "cpu_threads": cpu_threads,
+    }
+
+
+def _get_engine(engine_kwargs: dict):
+    """返回当前进程的 OCR 引擎，参数不变时复用"""
+    global _engine, _engine_kwargs
+    if _engine is None or _engine_kwargs != engine_kwargs:
+        _engine = PPStructure(**engine_kwargs)
+        _engine_kwargs = engine_kwargs
+    return _engine
+
+
+def _ocr_image(engine, img, idx: int, output_dir: Path, save_visual: bool) -> list:
+    """OCR 一页图像，返回可序列化的 PPStructure 原始结果（可写入 OCR 缓存）"""
+    print(f"[INFO] 正在处理第 {idx + 1} 页...")
+    img_np = np.array(img)
+    img_cv = cv2.cvtColor(img_np, cv2.COLOR_RGB2BGR)
+
+    results = engine(img_cv)
+    if save_visual:
+        structure_img = draw_structure_result(img_cv, results, font_path="simfang.ttf")
+        cv2.imwrite(str(output_dir / f"page_{idx+1}_structure.jpg"), structure_img)
+    return ocr_cache.to_serializable(results)
 
-    for idx, img in enumerate(images):
-        print(f"[INFO] 正在处理第 {idx + 1} 页...")
-        img_np = np.array(img)
-        img_cv = cv2.cvtColor(img_np, cv2.COLOR_RGB2BGR)
-
-        results = ocr_engine(img_cv)
-        if config.get("save_visual", False):
-            structure_img = draw_structure_result(img_cv, results, font_path="simfang.ttf")
-            cv2.imwrite(str(output_dir / f"page_{idx+1}_structure.jpg"), structure_img)
-
-        text_blocks = []
-        for region in results:
-            region_type = region["type"]
-            res = region.get("res")
-
-            if region_type in ["text", "title"] and isinstance(res, list):
-                for sub in res:
-                    text = clean_text(sub.get("text", ""))
-                    if not text.strip():
-                        continue
-                    text_blocks.append({
-                        "type": region_type,
-                        "text": text,
-                        "y": sub["text_region"][0][1]
-                    })
-
-            elif region_type == "table":
-                html_text = res.get("html", "") if isinstance(res, dict) else ""
-                markdown_table = html_table_to_markdown(html_text)
-                text_blocks.append({
-                    "type": "table",
-                    "text": markdown_table,
-                    "y": region["bbox"][1]
-                })
 
-            elif region_type == "figure":
+def _ocr_blocks(results: list, idx: int) -> list:
+    """将一页的 PPStructure 结果转换为 Markdown 条目（纯后处理，见 _render_blocks）"""
+    text_blocks = []
+    for region in results:
+        region_type = region["type"]
+        res = region.get("res")
+
+        if region_type in ["text", "title"] and isinstance(res, list):
+            for sub in res:
+                text = clean_text(sub.get("text", ""))
+                if not text.strip():
+                    continue
                 text_blocks.append({
-                    "type": "figure",
-                    "text": f"[图像区域 第{idx+1}页]",
-                    "y": region["bbox"][1]
+                    "type": region_type,
+                    "text": text,
+                    "y": sub["text_region"][0][1]
                 })
 
-            elif region_type in ["header", "footer"]:
+        elif region_type == "table":
+            html_text = res.get("html", "") if isinstance(res, dict) else ""
+            markdown_table = html_table_to_markdown(html_text)
+            text_blocks.append({
+                "type": "table",
+                "text": markdown_table,
+                "y": region["bbox"][1]
+            })
+
+        elif region_type == "figure":
+            text_blocks.append({
+                "type": "figure",
+                "text": f"[图像区域 第{idx+1}页]",
+                "y": region["bbox"][1]
+            })
+
+        elif region_type in ["header", "footer"]:
+            continue
+
+    return _render_blocks(text_blocks, idx)
+
+
+def _render_blocks(text_blocks: list, idx: int) -> list:
+    """
+    将一页的文本块（{"type", "text", "y"}）按纵坐标排序并转换为 Markdown 条目（OCR 与文本层共用）
+
+    返回:
+        list: [(kind, text)]，kind 为 "line"（原样输出）或 "para"（正文段落，合并时跨页去重）
+    """
+    text_blocks = sorted(text_blocks, key=lambda b: b["y"])
+    items = [("line", f"\n---\n第 {idx+1} 页\n---\n\n")]
+
+    for block in text_blocks:
+        if block["type"] == "table":
+            items.append(("line", block["text"] + "\n"))
+        elif block["type"] == "figure":
+            items.append(("line", block["text"] + "\n"))
+        else:
+            text = block["text"]
+            if block["type"] == "title":
+                text = auto_title_format(text)
+                items.append(("line", f"\n{text}\n"))
+            else:
+                for para in smart_paragraph_split(text):
+                    items.append(("para", para + "\n"))
+    return items
+
+
+def _join_lines(lines: list) -> str:
+    """拼接同一文本块内的行：中文行尾直接相连，西文行尾补空格"""
+    text = ""
+    for line in lines:
+        if text and not re.search(r"[\u4e00-\u9fff，。；：、）]$", text):
+            text += " "
+        text += line.strip()
+    return text
+
+
+def _text_layer_usable(text: str) -> bool:
+    """文本层字符数足够且不是乱码时才直接使用"""
+    chars = re.sub(r"\s", "", text)
+    if len(chars) < MIN_PAGE_CHARS:
+        return False
+    return len(_VALID_CHAR.findall(chars)) / len(chars) >= MIN_VALID_CHAR_RATIO
+
+
+def extract_text_layer(page, idx: int):
+    """
+    从 PyMuPDF 页面的文本层提取文本块
+
+    参数:
+        page: fitz.Page
+        idx (int): 页序号（从 0 开始）
+
+    返回:
+        list | None: 与 OCR 结果同构的 Markdown 条目；没有可用文本层或以图为主时返回 None（该页改走 OCR）
+    """
+    page_dict = page.get_text("dict")
+    width, height = page.rect.width, page.rect.height
+    raw_blocks, image_area = [], 0.0
+    for block in page_dict["blocks"]:
+        x0, y0, x1, y1 = block["bbox"]
+        if block["type"] == 1:  # 图片块
+            image_area += max(0.0, x1 - x0) * max(0.0, y1 - y0)
+            raw_blocks.append({"type": "figure", "text": f"[图像区域 第{idx+1}页]", "y": y0})
+            continue
+        if y1 <= height * HEADER_FOOTER_MARGIN or y0 >= height * (1 - HEADER_FOOTER_MARGIN):
+            continue
+        lines = ["".join(span["text"] for span in line["spans"]) for line in block["lines"]]
+        sizes = [span["size"] for line in block["lines"] for span in line["spans"] if span["text"].strip()]
+        text = clean_text(_join_lines(lines))
+        if text and sizes:
+            raw_blocks.append({"type": "text", "text": text, "y": y0, "size": max(sizes)})
+
+    text_blocks = [b for b in raw_blocks if b["type"] == "text"]
+    if not _text_layer_usable("".join(b["text"] for b in text_blocks)):
+        return None
+    if width and height and image_area / (width * height) > MAX_IMAGE_AREA_RATIO:
+        return None
+
+    body_size = float(np.median([b["size"] for b in text_blocks]))
+    for block in text_blocks:
+        if block["size"] > body_size * TITLE_SIZE_RATIO and len(block["text"]) <= TITLE_MAX_CHARS:
+            block["type"] = "title"
+    return _render_blocks(raw_blocks, idx)
+
+
+def iter_page_images(pdf_path: str, dpi: int, pages: list, window: int = PAGE_WINDOW):
+    """
+    按页窗口栅格化 PDF 的指定页，逐页产出 (页序号, 图像)
+
+    连续的页每次最多渲染 window 页，产出后即释放对该页的引用，调用方 OCR 完成后位图即可回收。
+
+    参数:
+        pages (list): 需要栅格化的页序号（从 0 开始，升序）
+    """
+    i = 0
+    while i < len(pages):
+        j = i + 1
+        while j < len(pages) and j - i < window and pages[j] == pages[j - 1] + 1:
+            j += 1
+        images = convert_from_path(pdf_path, dpi=dpi, first_page=pages[i] + 1, last_page=pages[j - 1] + 1)
+        for offset in range(len(images)):
+            img, images[offset] = images[offset], None
+            yield pages[i] + offset, img
+        del images
+        i = j
+
+
+def _init_worker(engine_kwargs: dict):
+    """进程池初始化：每个工作进程加载一次 OCR 引擎"""
+    _get_engine(engine_kwargs)
+
+
+def _ocr_page_worker(pdf_path: str, idx: int, dpi: int, output_dir: str, save_visual: bool):
+    """工作进程：自行栅格化第 idx 页（避免在进程间传输整页位图）并完成 OCR，返回原始结果"""
+    img = convert_from_path(pdf_path, dpi=dpi, first_page=idx + 1, last_page=idx + 1)[0]
+    return _ocr_image(_get_engine(_engine_kwargs), img, idx, Path(output_dir), save_visual)  # type: ignore
+
+
+def _merge_page(items: list, seen_paragraphs: set) -> list:
+    """合并一页的条目，正文段落与此前各页去重"""
+    md_lines = []
+    for kind, text in items:
+        if kind == "para":
+            if text in seen_paragraphs:
                 continue
+            seen_paragraphs.add(text)
+        md_lines.append(text)
+    return md_lines
 
-        text_blocks = sorted(text_blocks, key=lambda b: b["y"])
-        md_lines.append(f"\n---\n第 {idx+1} 页\n---\n\n")
 
-        for block in text_blocks:
-            if block["type"] == "table":
-                md_lines.append(block["text"] + "\n")
-            elif block["type"] == "figure":
-                md_lines.append(block["text"] + "\n")
+def _write_pages(md_path: Path, pages):
+    """按页序逐页合并并追加写入 Markdown，每页完成即落盘（内容与一次性写出相同）"""
+    seen_paragraphs = set()
+    first = True
+    with open(md_path, "w", encoding="utf-8") as f:
+        for items in pages:
+            md_lines = _merge_page(items, seen_paragraphs)
+            if not md_lines:
+                continue
+            f.write(("" if first else "\n") + "\n".join(md_lines))
+            f.flush()
+            first = False
+
+
+def parse_pdf_to_markdown(config: dict) -> str:
+    global _fitz_warned
+
+    pdf_path = config["pdf_path"]
+    output_dir = Path(config["output_dir"])
+    output_dir.mkdir(exist_ok=True, parents=True)
+    save_visual = config.get("save_visual", False)
+    dpi = config.get("dpi", PAGE_DPI)
+
+    # 有可用文本层的页直接提取（毫秒级），其余页（扫描页 / 以图为主）进入 OCR
+    native = {}
+    if fitz is None and config.get("text_layer", True):
+        if not _fitz_warned:
+            logger.warning("[警告] 未安装 PyMuPDF（pip install PyMuPDF），无法读取 PDF 文本层，所有页面将走 OCR")
+            _fitz_warned = True
+    if fitz is not None and config.get("text_layer", True):
+        with fitz.open(pdf_path) as doc:
+            n_pages = doc.page_count
+            for idx, page in enumerate(doc):
+                items = extract_text_layer(page, idx)
+                if items is not None:
+                    native[idx] = items
+    else:
+        n_pages = pdfinfo_from_path(pdf_path)["Pages"]
+    scanned = [idx for idx in range(n_pages) if idx not in native]
+
+    # 已 OCR 过的页直接取缓存的版面结果，只重做后处理（需要输出可视化图时不读缓存）
+    use_cache = config.get("ocr_cache", True) and not save_visual
+    cache_config = ocr_cache.config_key(_build_engine_kwargs(config, 1))
+    pdf_sha = file_sha256(Path(pdf_path)) if use_cache and scanned else ""
+    cached = ocr_cache.lookup(pdf_sha, scanned, dpi, cache_config) if pdf_sha else {}
+    ocr_pages = [idx for idx in scanned if idx not in cached]
+    print(f"[INFO] 共 {n_pages} 页：文本层直接提取 {len(native)} 页，OCR 缓存命中 {len(cached)} 页，OCR {len(ocr_pages)} 页")
+
+    workers = max(1, min(config.get("workers", OCR_WORKERS), len(ocr_pages)))
+    # 每个进程的推理线程数按核数均分，避免多进程 × 多线程超额订阅
+    cpu_threads = max(1, (os.cpu_count() or 1) // workers)
+    engine_kwargs = _build_engine_kwargs(config, cpu_threads)
+
+    def in_page_order(ocr_results):
+        """文本层页、缓存页与新 OCR 页按页序产出（新 OCR 结果按 ocr_pages 顺序到达，写入缓存后再做后处理）"""
+        for idx in range(n_pages):
+            if idx in native:
+                yield native[idx]
+            elif idx in cached:
+                yield _ocr_blocks(cached[idx], idx)
             else:
-                text = block["text"]
-                if block["type"] == "title":
-                    text = auto_title_format(text)
-                    md_lines.append(f"\n{text}\n")
-                else:
-                    for para in smart_paragraph_split(text):
-                        if para in seen_paragraphs:
-                            continue
-                        seen_paragraphs.add(para)
-                        md_lines.append(para + "\n")
+                results = next(ocr_results)
+                if use_cache:
+                    ocr_cache.store(pdf_sha, idx, dpi, cache_config, results)
+                yield _ocr_blocks(results, idx)
 
     md_path = output_dir / "output.md"
-    with open(md_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(md_lines))
+    if not ocr_pages:
+        _write_pages(md_path, in_page_order(iter(())))
+    elif workers == 1:
+        engine = _get_engine(engine_kwargs)
+        page_images = iter_page_images(pdf_path, dpi, ocr_pages, config.get("page_window", PAGE_WINDOW))
+        ocr_results = (_ocr_image(engine, img, idx, output_dir, save_visual) for idx, img in page_images)
+        _write_pages(md_path, in_page_order(ocr_results))
+    else:
+        print(f"[INFO] 使用 {workers} 个进程并行 OCR...")
+        # spawn：Paddle 推理库在 fork 出的子进程中不可靠
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(engine_kwargs,)) as executor:
+            futures = [executor.submit(_ocr_page_worker, pdf_path, idx, dpi, str(output_dir), save_visual)
+                       for idx in ocr_pages]
+            _write_pages(md_path, in_page_order(future.result() for future in futures))  # 按页序收集，前面的页先落盘
 
     print(f"[✅ 完成] Markdown 输出保存至: {md_path}")
-    return str(md_path)
\ No newline at end of file
+    return str(md_path)
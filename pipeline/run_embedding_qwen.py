@@ -1,23 +1,33 @@
 # pipeline/run_embedding_qwen.py
 
-import os
-import json
 import re
 # import numpy as np
-import requests
+from concurrent.futures import as_completed
 from pathlib import Path
 from tqdm import tqdm
-from openai import OpenAI
 
 from log_init import setup_logger 
-from pipeline.get_embedding_bgem3 import get_embedding_bge_m3
+from utils.api_clients import get_openai_client
+from utils.rate_limit import RetryExhaustedError, call_with_retry, estimate_tokens, post_json
+from utils.concurrency import AdaptiveExecutor
+from utils import job_ledger, embedding_cache
+from utils.atomic_io import atomic_write_json
+from pipeline import get_embedding_bgem3
+from pipeline.get_embedding_bgem3 import get_embedding_bge_m3, get_embedding_bge_m3_bucketed
+from pipeline.embedding_server import get_embedding_from_server
 
 
 logger = setup_logger(__name__)  # 初始化log信息
 
 MAX_TOKENS = 8192
 MAX_LINES = 10
-Embedding_Model_select = 3 # 1-qwen embedding3  2- BGE-M3(本地)  3- BGE-M3（硅基）
+Embedding_Model_select = 3 # 1-qwen embedding3  2- BGE-M3(本地)  3- BGE-M3（硅基）  4- BGE-M3(本地共享服务，见 embedding_server.py)
+GATHER_CHUNKS = 2048     # 分桶批量模式每轮汇集的段落数（跨多篇论文）
+BUCKET_BATCH_SIZE = 16   # 分桶批量模式单次前向推理的段落数
+REMOTE_BATCH_LIMIT = {1: 10, 3: 32, 4: 32}  # 并发模式下各接口单次请求的最大段落数（通义 v3 每次最多 10 条）
+REMOTE_PROVIDER = {1: "qwen", 3: "siliconflow", 4: "embedding_server"}  # 并发模式下共享并发上限的服务名
+EMBEDDING_MODEL_ID = {1: "qwen/text-embedding-v3", 2: "local/BAAI/bge-m3", 3: "siliconflow/BAAI/bge-m3",
+                      4: "server/BAAI/bge-m3"}  # 段落向量缓存中区分不同来源的模型标识
 
 
 def read_markdown(md_path: Path) -> str:
@@ -27,13 +37,11 @@ def read_markdown(md_path: Path) -> str:
 
 def get_qwen_embedding(text_list: list) -> list:
     """调用通义 embedding 接口"""
-    client = OpenAI(
-    api_key=os.getenv("QWEN_API_KEY"),
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-    )
-    response = client.embeddings.create(
+    client = get_openai_client("qwen")
+    response = call_with_retry("qwen", client.embeddings.create,
         input=text_list,
-        model="text-embedding-v3"
+        model="text-embedding-v3",
+        tokens=estimate_tokens(text_list)
     )
     return [item.embedding for item in response.data]
 
@@ -47,41 +55,123 @@ def get_query_embedding_bgem3(text_list:list) :
         text_list (list): 需要转换为向量的文本字符串列表
         
     返回:
-        list: 文本对应的向量嵌入列表，每个元素是一个数值向量；如果请求失败则返回空列表
+        list: 文本对应的向量嵌入列表，每个元素是一个数值向量
+
+    异常:
+        RetryExhaustedError: 限流 / 服务端错误重试用尽；其他 HTTP 错误直接抛出
     """
     url = "https://api.siliconflow.cn/v1/embeddings"
-    api_key=os.getenv("SOLID_API_KEY")
 
     payload = {
         "model": "BAAI/bge-m3",
         "input":  text_list,
         "encoding_format": "float"
     }
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
+
+    response_json = post_json("siliconflow", url, payload, tokens=estimate_tokens(text_list))
+    # 提取所有 embedding
+    return [item["embedding"] for item in response_json["data"]]
+
+def split_summary(text: str) -> list:
+    """
+    将 summary.md 内容切分为待向量化的段落
+
+    1. 按"## 技术要点"切分（丢弃第一个标题之前的内容）；
+    2. 每段不超过 MAX_TOKENS 字符，超出部分顺延为新段；
+    3. 最多保留 MAX_LINES 段，多余的合并进最后一段。
+    """
+    # 1. 先按照"技术要点"进行切分
+    split_pattern = r"(?=^##\s*技术要点)"  # 保留标题行本身，作为下一段开头
+    chunks = re.split(split_pattern, text, flags=re.MULTILINE)
+
+    #删去字符串列表的第一项（默认为技术要点）
+    del chunks[0]
+
+    # 2. 再确保每段不超过 MAX_TOKENS 字符
+    trimmed_chunks = []
+    for chunk in chunks:
+        while len(chunk) > MAX_TOKENS:
+            trimmed_chunks.append(chunk[:MAX_TOKENS])
+            chunk = chunk[MAX_TOKENS:]
+        trimmed_chunks.append(chunk)
+
+    # 3. 最多取前 10 段，多余的合并进最后一段
+    if len(trimmed_chunks) > MAX_LINES:
+        trimmed_chunks = trimmed_chunks[:MAX_LINES - 1] + ['\n'.join(trimmed_chunks[MAX_LINES - 1:])]
+    return trimmed_chunks
+
+def embedding_model_id() -> str:
+    """当前向量模型在段落缓存中的标识（本地 int8 快速模式的向量单独缓存）"""
+    model_id = EMBEDDING_MODEL_ID[Embedding_Model_select]
+    if Embedding_Model_select == 2 and get_embedding_bgem3.FAST_MODE:
+        model_id += ":int8"
+    return model_id
+
+def embedding_provider() -> str:
+    """当前向量模型共享并发上限的服务名（见 utils/concurrency.get_limiter）；本地模型统一为 embedding"""
+    return REMOTE_PROVIDER.get(Embedding_Model_select, "embedding")
+
+def needs_embedding(root_dir: Path, name: str) -> bool:
+    """<name>.json 不存在，或 summary.md 在其生成之后被修改过（重新总结）时需要（重新）向量化"""
+    output_path = root_dir / f"{name}.json"
+    if not output_path.exists():
+        return True
+    return (root_dir / name / "summary.md").stat().st_mtime > output_path.stat().st_mtime
+
+def embed_chunks(chunks: list) -> list:
+    """按 Embedding_Model_select 选择的模型生成段落向量；已缓存的段落不再请求（见 utils/embedding_cache.py）"""
+    return embedding_cache.embed_with_cache(chunks, embedding_model_id(), _embed_uncached)
+
+def _embed_uncached(chunks: list) -> list:
+    """直接调用所选模型生成段落向量"""
+    if Embedding_Model_select == 1:
+        embedding_list = get_qwen_embedding(chunks)
+    elif Embedding_Model_select == 2:
+        embedding_tensor = get_embedding_bge_m3(chunks)
+        embedding_list = embedding_tensor.cpu().tolist()
+    elif Embedding_Model_select == 3:
+        embedding_list = get_query_embedding_bgem3(chunks)
+    elif Embedding_Model_select == 4:
+        embedding_list = get_embedding_from_server(chunks)
+    return embedding_list
+
+def write_embedding_json(root_dir: Path, folder_name: str, text: str, chunks: list, embedding_list: list):
+    """将一篇论文的段落与向量写入 <root_dir>/<folder_name>.json"""
+    # embedding = np.mean(embedding_list, axis=0).tolist()  # 块之间做平均，舍弃
+
+    output_data = {
+        "folder": folder_name,
+        "text": text,#[:500],
+        "embeddings": [  # 每个段落的嵌入及对应原文
+            {
+                "chunk_index": i,
+                "text": chunk,
+                "embedding": vec
+            }
+            for i, (chunk, vec) in enumerate(zip(chunks, embedding_list))
+        ]
     }
 
-    response = requests.request("POST", url, json=payload, headers=headers)
-    if response.status_code == 200:
-        response_json = response.json()
-        # 提取所有 embedding
-        embeddings = [item["embedding"] for item in response_json["data"]]
-    else:
-        print("Error:", response.status_code, response.text)
-        embeddings = []
-    return embeddings
-
-def run_embedding_on_folder(root_dir: Path):
+    output_path = root_dir / f"{folder_name}.json"
+    atomic_write_json(output_path, output_data, ensure_ascii=False, indent=2)
+
+def run_embedding_on_folder(root_dir: Path, batch_mode: bool = False, overwrite: bool = False):
     """
     批量处理指定目录下的每个子目录中的 summary.md 文件，生成对应的文本嵌入向量并保存为 JSON 文件。
 
     参数:
         root_dir (Path): 包含多个子目录的根目录路径，每个子目录中应包含一个 summary.md 文件。
+        batch_mode (bool): 为 True 时跨论文汇集段落批量向量化：本地 BGE-M3 按长度分桶推理，
+                           远程接口则多篇论文的段落拼成满批、并发请求
+        overwrite (bool): 为 True 时已存在的 .json 也重新生成
 
     返回值:
         无返回值。处理结果将写入到与每个子目录同名的 .json 文件中。
     """
+    if batch_mode and Embedding_Model_select == 2:
+        return run_embedding_on_folder_batched(root_dir, overwrite)
+    if batch_mode:
+        return run_embedding_on_folder_concurrent(root_dir, overwrite)
        
     # 统计输出
     processed_count = 0
@@ -90,10 +180,10 @@ def run_embedding_on_folder(root_dir: Path):
     for subdir in tqdm(list(root_dir.iterdir()), desc="Embedding summaries"):
         if subdir.is_dir():
             md_path = subdir / "summary.md"
-            output_path = root_dir / f"{subdir.name}.json"\
+            output_path = root_dir / f"{subdir.name}.json"
             
-             # ✅ 若已存在 json 文件，则跳过该任务
-            if output_path.exists():
+             # ✅ 若已存在 json 文件且 summary.md 未更新，则跳过该任务
+            if output_path.exists() and not overwrite and not (md_path.exists() and needs_embedding(root_dir, subdir.name)):
                 # logger.error(f"[跳过] {output_path.name} 已存在，未重新提交。")
                 skipped_count += 1
                 continue
@@ -105,53 +195,179 @@ def run_embedding_on_folder(root_dir: Path):
                         logger.warning(f"[警告] {md_path} 内容为空，跳过。")
                         continue
                     
-                    # 1. 先按照"技术要点"进行切分
-                    split_pattern = r"(?=^##\s*技术要点)"  # 保留标题行本身，作为下一段开头
-                    chunks = re.split(split_pattern, text, flags=re.MULTILINE)
-                    
-                    #删去字符串列表的第一项（默认为技术要点）
-                    del chunks[0]
-                    
-                    # 2. 再确保每段不超过 MAX_TOKENS 字符
-                    trimmed_chunks = []
-                    for chunk in chunks:
-                        while len(chunk) > MAX_TOKENS:
-                            trimmed_chunks.append(chunk[:MAX_TOKENS])
-                            chunk = chunk[MAX_TOKENS:]
-                        trimmed_chunks.append(chunk)
-                    
-                    # 3. 最多取前 10 段，多余的合并进最后一段
-                    if len(trimmed_chunks) > MAX_LINES:
-                        trimmed_chunks = trimmed_chunks[:MAX_LINES - 1] + ['\n'.join(trimmed_chunks[MAX_LINES - 1:])]
-                    if Embedding_Model_select == 1:
-                        embedding_list = get_qwen_embedding(trimmed_chunks)
-                    elif Embedding_Model_select == 2:
-                        embedding_tensor = get_embedding_bge_m3(trimmed_chunks)
-                        embedding_list = embedding_tensor.cpu().tolist()
-                    elif Embedding_Model_select == 3:
-                        embedding_list = get_query_embedding_bgem3(trimmed_chunks)
-
-                    # embedding = np.mean(embedding_list, axis=0).tolist()  # 块之间做平均，舍弃
-
-                    output_data = {
-                        "folder": subdir.name,
-                        "text": text,#[:500],
-                        "embeddings": [  # 每个段落的嵌入及对应原文
-                            {
-                                "chunk_index": i,
-                                "text": chunk,
-                                "embedding": vec
-                            }
-                            for i, (chunk, vec) in enumerate(zip(trimmed_chunks, embedding_list))
-                        ]
-                    }
-
-                    output_path = root_dir / f"{subdir.name}.json"
+                    with job_ledger.track(subdir.name, job_ledger.STAGE_EMBED):
+                        trimmed_chunks = split_summary(text)
+                        embedding_list = embed_chunks(trimmed_chunks)
+                        write_embedding_json(root_dir, subdir.name, text, trimmed_chunks, embedding_list)
                     processed_count += 1
-                    with open(output_path, "w", encoding="utf-8") as f:
-                        json.dump(output_data, f, ensure_ascii=False, indent=2)
 
                 except Exception as e:
                     logger.error(f"[错误] 处理 {md_path} 时异常：{e}")
                     
-    logger.info(f"\n✅ 总共处理: {processed_count} 篇 | 跳过: {skipped_count} 篇\n")
\ No newline at end of file
+    logger.info(f"\n✅ 总共处理: {processed_count} 篇 | 跳过: {skipped_count} 篇\n")
+
+def collect_papers(root_dir: Path, overwrite: bool = False):
+    """
+    收集待向量化的论文
+
+    返回:
+        (papers, skipped_count)：papers 为 [(论文名, 全文, 段落列表)]，skipped_count 为已有最新 .json 而跳过的篇数
+    """
+    papers = []
+    skipped_count = 0
+    for subdir in sorted(root_dir.iterdir()):
+        md_path = subdir / "summary.md"
+        if not subdir.is_dir() or not md_path.exists():
+            continue
+        if not overwrite and not needs_embedding(root_dir, subdir.name):
+            skipped_count += 1
+            continue
+        text = read_markdown(md_path)
+        if len(text.strip()) == 0:
+            logger.warning(f"[警告] {md_path} 内容为空，跳过。")
+            continue
+        papers.append((subdir.name, text, split_summary(text)))
+    return papers, skipped_count
+
+def run_embedding_on_folder_batched(root_dir: Path, overwrite: bool = False):
+    """
+    跨论文分桶批量向量化（本地 BGE-M3）
+
+    逐篇调用时每次只有一篇论文的几个段落，且按该批最长段落补齐，补齐浪费和单次调用开销都很大。
+    本函数把多篇论文的段落汇集起来（每轮最多 GATHER_CHUNKS 段），未缓存的段落交给
+    get_embedding_bge_m3_bucketed 按 token 长度排序分桶、固定批大小推理，再把向量按论文拆回写盘。
+    每篇论文的向量化阶段照常记入台账（job_ledger.STAGE_EMBED）。
+
+    参数:
+        root_dir (Path): 包含多个子目录的根目录路径，每个子目录中应包含一个 summary.md 文件。
+        overwrite (bool): 为 True 时已存在的 .json 也重新生成（全库重新向量化）
+    """
+    papers, skipped_count = collect_papers(root_dir, overwrite)
+    processed_count = 0
+    with tqdm(total=len(papers), desc="Embedding summaries (bucketed)") as bar:
+        start = 0
+        while start < len(papers):
+            # 汇集若干篇论文的段落，凑够 GATHER_CHUNKS 段为一轮
+            end, n_chunks = start, 0
+            while end < len(papers) and (n_chunks == 0 or n_chunks + len(papers[end][2]) <= GATHER_CHUNKS):
+                n_chunks += len(papers[end][2])
+                end += 1
+            group = papers[start:end]
+            all_chunks = [chunk for _, _, chunks in group for chunk in chunks]
+            started_at = {name: job_ledger.start(name, job_ledger.STAGE_EMBED) for name, _, _ in group}
+            try:
+                vectors = embedding_cache.embed_with_cache(
+                    all_chunks, embedding_model_id(),
+                    lambda texts: get_embedding_bge_m3_bucketed(texts, BUCKET_BATCH_SIZE).cpu().tolist()) if all_chunks else []
+                offset = 0
+                for name, text, chunks in group:
+                    write_embedding_json(root_dir, name, text, chunks, vectors[offset:offset + len(chunks)])
+                    job_ledger.finish(name, job_ledger.STAGE_EMBED, started_at.pop(name))
+                    offset += len(chunks)
+                    processed_count += 1
+            except Exception as e:
+                logger.error(f"[错误] 批量处理 {group[0][0]} 等 {len(group)} 篇时异常：{e}")
+                for name, t0 in started_at.items():  # 尚未写出的论文记为失败
+                    job_ledger.finish(name, job_ledger.STAGE_EMBED, t0, f"{type(e).__name__}: {e}")
+            bar.update(len(group))
+            start = end
+
+    logger.info(f"\n✅ 总共处理: {processed_count} 篇 | 跳过: {skipped_count} 篇\n")
+
+def run_embedding_on_folder_concurrent(root_dir: Path, overwrite: bool = False, max_workers: int = None): # type: ignore
+    """
+    远程接口并发批量向量化（通义 / 硅基 / 本地共享服务）
+
+    逐篇调用时每篇论文一次阻塞请求，总耗时由网络往返决定。本函数先从段落缓存取出已有向量，把其余段落去重后依次拼接，
+    按接口的单次条数上限（REMOTE_BATCH_LIMIT）切成满批，经 AdaptiveExecutor 并发请求（并发数按服务端状况自动调节）；
+    某篇论文的全部段落返回后立即写出其 .json。某批请求失败时二分拆开重试，直到定位出错的段落：
+    只有包含该段落的论文本轮不写出（下次运行时重试），同批其他段落的向量照常写入缓存与 .json；
+    限流 / 服务端错误重试用尽（RetryExhaustedError）与具体段落无关，整批直接失败不再拆分。
+    每篇论文的向量化阶段照常记入台账（job_ledger.STAGE_EMBED）。
+
+    参数:
+        root_dir (Path): 包含多个子目录的根目录路径，每个子目录中应包含一个 summary.md 文件。
+        overwrite (bool): 为 True 时已存在的 .json 也重新生成
+        max_workers (int): 可选，并发数的上界
+    """
+    papers, skipped_count = collect_papers(root_dir, overwrite)
+    limit = REMOTE_BATCH_LIMIT.get(Embedding_Model_select, 10)
+    model_id = embedding_model_id()
+
+    # 先取段落缓存；未命中的段落按文本去重（相同段落只请求一次），记录其在各论文中的位置
+    vectors = [embedding_cache.lookup_many(model_id, chunks) for _, _, chunks in papers]
+    slots = {}  # 段落文本 → [(论文序号, 段落序号)]
+    for p, (_, _, chunks) in enumerate(papers):
+        for c, chunk in enumerate(chunks):
+            if vectors[p][c] is None:
+                slots.setdefault(chunk, []).append((p, c))
+    texts = list(slots)
+    batches = [texts[i:i + limit] for i in range(0, len(texts), limit)]  # 一批可跨多篇论文
+    remaining = [sum(v is None for v in vecs) for vecs in vectors]  # 各论文尚未返回的段落数
+    started_at = [job_ledger.start(name, job_ledger.STAGE_EMBED) for name, _, _ in papers]
+    errors = {}  # 段落文本 → 错误信息（无法向量化的段落）
+    failed = {}  # 论文序号 → 错误信息
+
+    def embed_batch(batch):
+        """请求一批段落，返回与 batch 等长的向量列表，无法向量化的段落为 None"""
+        try:
+            embedding_list = _embed_uncached(batch)
+            if len(embedding_list) != len(batch):
+                raise RuntimeError(f"接口返回 {len(embedding_list)} 条向量，期望 {len(batch)} 条")
+        except RetryExhaustedError:
+            raise
+        except Exception as e:
+            if len(batch) == 1:
+                names = sorted({papers[p][0] for p, _ in slots[batch[0]]})
+                logger.error(f"[错误] 向量化 {', '.join(names)} 的段落时异常：{e}")
+                errors[batch[0]] = f"{type(e).__name__}: {e}"
+                return [None]
+            mid = len(batch) // 2
+            return embed_batch(batch[:mid]) + embed_batch(batch[mid:])
+        embedding_cache.store_many(model_id, batch, embedding_list)
+        return embedding_list
+
+    processed_count = 0
+    with AdaptiveExecutor(embedding_provider(), max_workers, workload="embedding") as executor, \
+            tqdm(total=len(papers), desc="Embedding summaries (concurrent)") as bar:
+        for p in (p for p, n in enumerate(remaining) if n == 0):
+            # 段落全部命中缓存（或没有"技术要点"段落）的论文无需请求，直接写出
+            write_embedding_json(root_dir, papers[p][0], papers[p][1], papers[p][2], vectors[p])
+            job_ledger.finish(papers[p][0], job_ledger.STAGE_EMBED, started_at[p])
+            processed_count += 1
+            bar.update(1)
+        futures = {executor.submit(embed_batch, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                embedding_list = future.result()
+            except Exception as e:
+                names = sorted({papers[p][0] for text in batch for p, _ in slots[text]})
+                logger.error(f"[错误] 向量化 {', '.join(names)} 时异常：{e}")
+                errors.update((text, f"{type(e).__name__}: {e}") for text in batch)
+                embedding_list = [None] * len(batch)
+            for text, vec in zip(batch, embedding_list):
+                for p, c in slots[text]:
+                    if vec is None:
+                        failed.setdefault(p, errors.get(text, "向量化失败"))
+                    else:
+                        vectors[p][c] = vec
+                    remaining[p] -= 1
+                    if remaining[p] > 0:
+                        continue
+                    # 该论文的全部段落已返回
+                    bar.update(1)
+                    name, text_all, chunks = papers[p]
+                    if p in failed:
+                        job_ledger.finish(name, job_ledger.STAGE_EMBED, started_at[p], failed[p])
+                        continue
+                    try:
+                        write_embedding_json(root_dir, name, text_all, chunks, vectors[p])
+                        job_ledger.finish(name, job_ledger.STAGE_EMBED, started_at[p])
+                        processed_count += 1
+                    except Exception as e:
+                        logger.error(f"[错误] 写出 {name}.json 时异常：{e}")
+                        job_ledger.finish(name, job_ledger.STAGE_EMBED, started_at[p], f"{type(e).__name__}: {e}")
+                    vectors[p] = None  # 写出后释放
+
+    logger.info(f"\n✅ 总共处理: {processed_count} 篇 | 跳过: {skipped_count} 篇 | 失败: {len(failed)} 篇\n")
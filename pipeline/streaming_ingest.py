@@ -0,0 +1,175 @@
+# pipeline/streaming_ingest.py
+"""
+流式入库：总结 → 向量化 → 检索索引 三个阶段重叠执行
+
+原流程先等所有 PDF 总结完成，再遍历整个目录做向量化，最后同步索引；第一篇论文的向量化
+要等最慢的那篇总结结束。这里每写出一篇 summary.md 就放入有界队列，由向量化线程立即处理，
+向量化结果再交给索引线程批量写入检索索引（vector_index.update_index）：
+
+    summarize_pdfs_async ──(summary 队列)──> 向量化线程 ──(索引队列)──> 索引线程
+
+向量化请求与其他入库路径共用向量服务的 AdaptiveLimiter（utils/concurrency），实际并发数按服务端状况自动调节；
+线程数只是并发数的上界。
+队列有界：下游处理不过来时上游的回调阻塞等待（背压），内存占用不随文献数量增长。
+索引线程是本流程中唯一写检索索引的地方；检索端（load_index）只读，跨进程的写入由索引写锁串行化。
+"""
+
+import time
+import queue
+import threading
+from pathlib import Path
+from typing import List, Tuple
+
+from log_init import setup_logger
+from pipeline.run_embedding_qwen import (read_markdown, split_summary, embed_chunks, write_embedding_json,
+                                         needs_embedding, embedding_provider)
+from pipeline.summarize_with_qwen_long import summarize_pdfs_async
+from research_pipeline.vector_index import update_index
+from utils import job_ledger
+from utils.concurrency import get_limiter
+
+logger = setup_logger(__name__)  # 初始化log信息
+
+QUEUE_SIZE = 32          # 两个队列的容量
+INDEX_BATCH = 16         # 累计多少篇论文后同步一次索引
+INDEX_INTERVAL = 30.0    # 有待同步论文时最长等待时间（秒），避免索引长时间落后
+_DONE = None             # 队列结束标记
+
+_stats_lock = threading.Lock()
+
+
+def _count(stats: dict, key: str, n: int = 1):
+    with _stats_lock:
+        stats[key] += n
+
+
+def _embed_limited(chunks: list) -> list:
+    """经向量服务的共享 limiter 调用 embed_chunks；失败计入 limiter 的错误率"""
+    limiter = get_limiter(embedding_provider())
+    limiter.acquire()
+    started = time.monotonic()
+    ok = False
+    try:
+        embedding_list = embed_chunks(chunks)
+        ok = True
+        return embedding_list
+    finally:
+        limiter.release(started, ok, "streaming_embedding")
+
+
+def _embed_worker(root_dir: Path, summary_queue: queue.Queue, index_queue: queue.Queue, stats: dict):
+    """向量化线程：取出一篇论文的 summary.md，切分、向量化、写出 <论文名>.json"""
+    while True:
+        item = summary_queue.get()
+        if item is _DONE:
+            return
+        name = item
+        md_path = root_dir / name / "summary.md"
+        try:
+            text = read_markdown(md_path)
+            if len(text.strip()) == 0:
+                logger.warning(f"[警告] {md_path} 内容为空，跳过。")
+                continue
+            with job_ledger.track(name, job_ledger.STAGE_EMBED):
+                chunks = split_summary(text)
+                write_embedding_json(root_dir, name, text, chunks, _embed_limited(chunks))
+            _count(stats, "embedded")
+            index_queue.put(name)
+        except Exception as e:
+            _count(stats, "embed_failed")
+            logger.error(f"[错误] 向量化 {name} 时异常：{e}")
+
+
+def _index_worker(root_dir: Path, index_queue: queue.Queue, stats: dict):
+    """
+    索引线程：攒够 INDEX_BATCH 篇或距第一篇待同步论文超过 INDEX_INTERVAL 秒时同步一次索引；
+    收到结束标记后无论有无待同步论文都再同步一次，顺带纳入手工增删的论文
+    """
+    pending = []
+    first_pending = 0.0
+    finished = False
+    while not finished:
+        timeout = None if not pending else max(0.0, first_pending + INDEX_INTERVAL - time.monotonic())
+        try:
+            item = index_queue.get(timeout=timeout)
+            if item is _DONE:
+                finished = True
+            else:
+                pending.append(item)
+                first_pending = first_pending if len(pending) > 1 else time.monotonic()
+        except queue.Empty:
+            pass
+        due = pending and (len(pending) >= INDEX_BATCH or time.monotonic() - first_pending >= INDEX_INTERVAL)
+        if due or finished:
+            started = {name: job_ledger.start(name, job_ledger.STAGE_INDEX) for name in pending}
+            error = None
+            try:
+                result = update_index(root_dir)
+                _count(stats, "indexed", len(pending))
+                logger.info(f"[索引] 已同步 {len(pending)} 篇新论文：{result}")  # 结束时的兜底同步可能为 0 篇
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                logger.error(f"[错误] 同步检索索引时异常：{e}")
+            for name, started_at in started.items():
+                job_ledger.finish(name, job_ledger.STAGE_INDEX, started_at, error)
+            pending = []
+
+
+def run_streaming_ingest(tasks: List[Tuple[Path, Path]], root_dir: Path, prompt: str,
+                         embed_workers: int = None) -> dict: # type: ignore
+    """
+    总结、向量化、索引流水线式执行
+
+    参数:
+        tasks (list): 待总结的 [(pdf_path, output_dir)]，output_dir 为 root_dir 下的论文目录
+        root_dir (Path): 文献库目录（summary.md 与 <论文名>.json 所在目录）
+        prompt (str): 摘要生成提示语
+        embed_workers (int): 可选，向量化线程数（并发数的上界），默认为 limiter 的上界；
+                             实际并发数由向量服务的 AdaptiveLimiter 自动调节
+
+    返回:
+        dict: {"summarized", "summary_failed", "embedded", "embed_failed", "indexed"}
+    """
+    summary_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    index_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    stats = {"summarized": 0, "summary_failed": 0, "embedded": 0, "embed_failed": 0, "indexed": 0}
+
+    embed_workers = embed_workers or get_limiter(embedding_provider()).max_limit
+    workers = [threading.Thread(target=_embed_worker, args=(root_dir, summary_queue, index_queue, stats), daemon=True)
+               for _ in range(embed_workers)]
+    indexer = threading.Thread(target=_index_worker, args=(root_dir, index_queue, stats), daemon=True)
+    for t in workers + [indexer]:
+        t.start()
+
+    # 上次运行已总结但尚未向量化（向量化中断 / 失败，或 summary.md 之后被更新）的论文在后台入队，不推迟本次总结的开始；
+    # 本次要重新总结的论文由 on_summary_done 入队，不放入积压列表，避免同一篇论文向量化、索引两次
+    unfinished_embed = set(job_ledger.unfinished(job_ledger.STAGE_EMBED))
+    task_names = {output_dir.name for _, output_dir in tasks}
+    backlog = [subdir.name for subdir in sorted(root_dir.iterdir())
+               if subdir.is_dir() and subdir.name not in task_names and (subdir / "summary.md").exists()
+               and (subdir.name in unfinished_embed or needs_embedding(root_dir, subdir.name))]
+    feeder = threading.Thread(target=lambda: [summary_queue.put(name) for name in backlog], daemon=True)
+    feeder.start()
+
+    def on_summary_done(pdf_path: Path, output_dir: Path):
+        summary_queue.put(output_dir.name)
+
+    results = summarize_pdfs_async(tasks, prompt, on_done=on_summary_done)
+    for pdf_name, error in results.items():
+        if error is None:
+            stats["summarized"] += 1
+            logger.info(f"[完成] {pdf_name} 摘要生成成功。\n")
+        else:
+            stats["summary_failed"] += 1
+            logger.error(f"[错误] 处理 {pdf_name} 时出错：{error}\n")
+
+    feeder.join()
+    for _ in workers:
+        summary_queue.put(_DONE)
+    for t in workers:
+        t.join()
+    index_queue.put(_DONE)
+    indexer.join()
+
+    logger.info(f"\n✅ 流式入库完成：{stats}\n")
+    return stats
@@ -1,7 +1,10 @@
 import os
 from pathlib import Path
 from dotenv import load_dotenv
-from openai import OpenAI
+from utils.api_clients import get_openai_client
+from utils.rate_limit import call_with_retry, estimate_tokens
+from utils.atomic_io import atomic_write_text
+from utils import response_cache
 
 MIN_BLOCK_LENGTH = 100
 
@@ -22,7 +25,7 @@ def summarize_markdown(md_path: str, config: dict) -> list[str]:
     if not api_key:
         raise ValueError("❌ 未提供 DeepSeek API Key，请设置 config['deepseek_api_key'] 或 .env 文件")
 
-    client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com/v1")
+    client = get_openai_client("deepseek", api_key)
 
     with open(md_path, "r", encoding="utf-8") as f:
         content = f.read()
@@ -30,13 +33,20 @@ def summarize_markdown(md_path: str, config: dict) -> list[str]:
     prompt = config.get("prompt_template", "")
     full_prompt = prompt + "\n\n" + content
 
-    response = client.chat.completions.create(
-        model=config.get("model", "deepseek-chat"),
-        messages=[{"role": "user", "content": full_prompt}],
-        temperature=0.5,
-    )
+    model = config.get("model", "deepseek-chat")
+    messages = [{"role": "user", "content": full_prompt}]
 
-    result_text = response.choices[0].message.content
+    def generate():
+        response = call_with_retry("deepseek", client.chat.completions.create,
+            model=model,
+            messages=messages,
+            temperature=0.5,
+            tokens=estimate_tokens(full_prompt),
+        )
+        return response.choices[0].message.content
+
+    # 提示词与文档内容不变时直接复用上次的结果
+    result_text = response_cache.cached(generate, "chat", "deepseek", model, messages=messages, temperature=0.5)
     output_dir = Path(config["output_dir"])
     output_dir.mkdir(parents=True, exist_ok=True)
 
@@ -55,8 +65,7 @@ def summarize_markdown(md_path: str, config: dict) -> list[str]:
         block += f"\n- 对应文献：{pdf_name}"
 
         out_path = output_dir / f"tech_{n_block}.md"
-        with open(out_path, "w", encoding="utf-8") as f:
-            f.write(block)
+        atomic_write_text(out_path, block)
         output_paths.append(str(out_path))
         n_block += 1
 
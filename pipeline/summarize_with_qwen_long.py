@@ -1,17 +1,30 @@
 # pipeline/summarize_with_qwen.py
-import os
 import time
+import asyncio
 from pathlib import Path
-from openai import OpenAI
+from typing import List, Tuple
+from utils.api_clients import get_openai_client, create_async_openai_client
+from utils.rate_limit import call_with_retry, acall_with_retry, estimate_tokens
+from utils import file_registry, job_ledger, response_cache
+from utils.atomic_io import atomic_write_text
 from dotenv import load_dotenv
 from log_init import setup_logger 
 
 load_dotenv()
 logger = setup_logger(__name__)  # 初始化log信息
-client = OpenAI(
-    api_key=os.getenv("QWEN_API_KEY"),
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-)
+client = get_openai_client("qwen")
+
+SUMMARY_MODEL = "qwen-long-latest"
+SYSTEM_PROMPT = '你是一个具有通信领域专业背景的研究助手，请你参考专业知识协助我进行文献整理。'
+
+# 异步流水线：三个环节分别限流
+UPLOAD_CONCURRENCY = 4    # 同时上传的文件数（受本地上行带宽限制）
+POLL_CONCURRENCY = 16     # 同时在途的解析状态查询数（只限制查询请求，等待解析期间不占名额）
+STREAM_CONCURRENCY = 8    # 同时进行的流式总结数
+POLL_INITIAL = 1.0        # 解析状态首次查询间隔（秒）
+POLL_MAX_INTERVAL = 10.0  # 查询间隔上限（秒），每次查询后间隔乘以 POLL_BACKOFF
+POLL_BACKOFF = 1.5
+POLL_TIMEOUT = 300        # 单个文件等待解析的最长时间（秒）
 
 def wait_for_file_ready(client, file_id, max_retries=30, interval=2):
     """
@@ -53,37 +66,196 @@ def upload_and_summarize_pdf(pdf_path: Path, output_dir: Path, prompt: str):
     返回值:
         无返回值。摘要内容将被写入到output_dir下的summary.md文件中。
     """
+    name = output_dir.name  # 台账中的论文名
+    cache_key = summary_cache_key(pdf_path, prompt)
+    cached_summary = response_cache.get(cache_key)
+    if cached_summary is not None:
+        logger.info(f"[缓存] {pdf_path.name} 命中摘要缓存，跳过上传与生成")
+        with job_ledger.track(name, job_ledger.STAGE_SUMMARIZE):
+            save_summary(cached_summary, output_dir)
+        return
+
     logger.info(f"[Qwen] Uploading {pdf_path.name} ...")
-    file_object = client.files.create(file=pdf_path, purpose="file-extract") # type: ignore
-    file_id = file_object.id
+    # 同一文件已上传过且仍有效时直接复用 file_id（见 utils/file_registry.py）
+    with job_ledger.track(name, job_ledger.STAGE_UPLOAD):
+        file_id, ready = file_registry.get_or_upload(client, pdf_path)
 
     # 新增：等待解析完成
-    if not wait_for_file_ready(client, file_id):
-        raise Exception(f"文件 {pdf_path.name} 长时间未解析成功，跳过。")
+    with job_ledger.track(name, job_ledger.STAGE_PARSE):
+        if not ready:
+            if not wait_for_file_ready(client, file_id):
+                raise Exception(f"文件 {pdf_path.name} 长时间未解析成功，跳过。")
+            file_registry.mark_processed(file_id)
+
+    messages = build_messages(file_id, prompt)
+
+    def generate():
+        completion = client.chat.completions.create(
+            model = SUMMARY_MODEL,
+            messages=messages, # type: ignore
+            stream=True,
+            stream_options={"include_usage": True}
+        ) # type: ignore
+
+        summary = ""
+        for chunk in completion:
+            if chunk.choices and chunk.choices[0].delta.content:
+                summary += chunk.choices[0].delta.content
+        return summary
 
-    messages = [
-        {'role': 'system', 'content': '你是一个具有通信领域专业背景的研究助手，请你参考专业知识协助我进行文献整理。'},
+    logger.info(f"[Qwen] Generating summary for {pdf_path.name} ...")
+    with job_ledger.track(name, job_ledger.STAGE_SUMMARIZE):
+        # 流式输出中途断开时整段重新生成
+        summary = call_with_retry("qwen", generate, tokens=estimate_tokens(prompt))
+        response_cache.put(cache_key, summary)
+        save_summary(summary, output_dir)
+
+def summary_cache_key(pdf_path: Path, prompt: str) -> str:
+    """摘要的缓存键：file_id 每次上传都会变化，因此按 PDF 内容的 SHA-256 而非 file_id 计算"""
+    return response_cache.make_key("chat", "qwen", SUMMARY_MODEL, document=file_registry.file_sha256(pdf_path),
+                                   system=SYSTEM_PROMPT, prompt=prompt)
+
+def build_messages(file_id: str, prompt: str) -> list:
+    """构造引用已上传文件的 qwen-long 对话消息"""
+    return [
+        {'role': 'system', 'content': SYSTEM_PROMPT},
         {'role': 'system', 'content': f'fileid://{file_id}'},
         {'role': 'user', 'content': prompt}
     ]
 
-    logger.info(f"[Qwen] Generating summary for {pdf_path.name} ...")
-    completion = client.chat.completions.create(
-        model = "qwen-long-latest",
-        messages=messages, # type: ignore
-        stream=True,
-        stream_options={"include_usage": True}
-    ) # type: ignore
-
-    summary = ""
-    for chunk in completion:
-        if chunk.choices and chunk.choices[0].delta.content:
-            summary += chunk.choices[0].delta.content
-
+def save_summary(summary: str, output_dir: Path):
+    """修正 LaTeX 定界符后原子写入 output_dir/summary.md（崩溃时不会留下截断的文件）"""
     summary = summary.replace('\\[', '$').replace('\\]', '$')
 
     output_dir.mkdir(parents=True, exist_ok=True)
     out_path = output_dir / "summary.md"
-    with open(out_path, "w", encoding="utf-8") as f:
-        f.write(summary)
+    atomic_write_text(out_path, summary)
     logger.info(f"[Qwen] Saved summary to {out_path}")
+
+async def wait_for_file_ready_async(aclient, file_id: str, poll_sem: asyncio.Semaphore, timeout: float = POLL_TIMEOUT) -> bool:
+    """
+    异步等待文件解析完成
+
+    查询间隔从 POLL_INITIAL 开始按 POLL_BACKOFF 递增到 POLL_MAX_INTERVAL：小文件很快就绪，
+    大文件也不会被高频轮询。等待期间只占用协程，不占线程，也不占 poll_sem 名额。
+
+    参数:
+        aclient: AsyncOpenAI 客户端
+        file_id (str): 文件唯一标识符
+        poll_sem (asyncio.Semaphore): 限制同时在途的状态查询数
+        timeout (float): 最长等待时间（秒）
+
+    返回值:
+        bool: 在 timeout 内解析完成返回 True；超时或服务端报告解析失败返回 False
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    interval = POLL_INITIAL
+    while loop.time() < deadline:
+        await asyncio.sleep(interval)
+        try:
+            async with poll_sem:
+                file_info = await acall_with_retry("qwen", aclient.files.retrieve, file_id)
+            status = getattr(file_info, "status", "")
+            if status == "processed":
+                return True
+            if status == "error":
+                return False
+        except Exception as e:
+            logger.warning(f"[Qwen] 查询文件 {file_id} 状态失败：{e}")
+        interval = min(interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+    return False
+
+async def upload_and_summarize_pdf_async(aclient, pdf_path: Path, output_dir: Path, prompt: str,
+                                         sems: Tuple[asyncio.Semaphore, asyncio.Semaphore, asyncio.Semaphore]):
+    """
+    upload_and_summarize_pdf 的协程版本
+
+    参数:
+        aclient: AsyncOpenAI 客户端
+        pdf_path (Path): 待处理的PDF文件路径。
+        output_dir (Path): 摘要输出目录路径。
+        prompt (str): 摘要生成提示语。
+        sems (tuple): (上传, 状态查询, 流式总结) 三个环节的信号量
+    """
+    upload_sem, poll_sem, stream_sem = sems
+
+    # 文件哈希、SQLite（缓存 / 登记表 / 台账）与写文件都放到线程中执行，不阻塞事件循环
+    name = output_dir.name  # 台账中的论文名
+    cache_key = await asyncio.to_thread(summary_cache_key, pdf_path, prompt)
+    cached_summary = await asyncio.to_thread(response_cache.get, cache_key)
+    if cached_summary is not None:
+        logger.info(f"[缓存] {pdf_path.name} 命中摘要缓存，跳过上传与生成")
+        async with job_ledger.atrack(name, job_ledger.STAGE_SUMMARIZE):
+            await asyncio.to_thread(save_summary, cached_summary, output_dir)
+        return
+
+    logger.info(f"[Qwen] Uploading {pdf_path.name} ...")
+    async with job_ledger.atrack(name, job_ledger.STAGE_UPLOAD):
+        file_id, ready = await file_registry.aget_or_upload(aclient, pdf_path, upload_sem=upload_sem)
+
+    async with job_ledger.atrack(name, job_ledger.STAGE_PARSE):
+        if not ready:
+            if not await wait_for_file_ready_async(aclient, file_id, poll_sem):
+                raise Exception(f"文件 {pdf_path.name} 长时间未解析成功，跳过。")
+            await asyncio.to_thread(file_registry.mark_processed, file_id)
+
+    messages = build_messages(file_id, prompt)
+
+    async def generate():
+        completion = await aclient.chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=messages, # type: ignore
+            stream=True,
+            stream_options={"include_usage": True}
+        ) # type: ignore
+
+        summary = ""
+        async for chunk in completion:
+            if chunk.choices and chunk.choices[0].delta.content:
+                summary += chunk.choices[0].delta.content
+        return summary
+
+    async with stream_sem:
+        logger.info(f"[Qwen] Generating summary for {pdf_path.name} ...")
+        async with job_ledger.atrack(name, job_ledger.STAGE_SUMMARIZE):
+            # 流式输出中途断开时整段重新生成
+            summary = await acall_with_retry("qwen", generate, tokens=estimate_tokens(prompt))
+            await asyncio.to_thread(response_cache.put, cache_key, summary)
+            await asyncio.to_thread(save_summary, summary, output_dir)
+
+async def _summarize_pdfs(tasks: List[Tuple[Path, Path]], prompt: str, on_done=None) -> dict:
+    aclient = create_async_openai_client("qwen")
+    sems = (asyncio.Semaphore(UPLOAD_CONCURRENCY), asyncio.Semaphore(POLL_CONCURRENCY), asyncio.Semaphore(STREAM_CONCURRENCY))
+
+    async def run_one(pdf_path: Path, target_dir: Path):
+        await upload_and_summarize_pdf_async(aclient, pdf_path, target_dir, prompt, sems)
+        if on_done is not None:
+            # 回调可能阻塞（如写入有界队列），放到线程中执行，不阻塞事件循环
+            await asyncio.to_thread(on_done, pdf_path, target_dir)
+
+    try:
+        results = await asyncio.gather(
+            *(run_one(pdf_path, target_dir) for pdf_path, target_dir in tasks),
+            return_exceptions=True,
+        )
+    finally:
+        await aclient.close()
+    return {pdf_path.name: result for (pdf_path, _), result in zip(tasks, results)}
+
+def summarize_pdfs_async(tasks: List[Tuple[Path, Path]], prompt: str, on_done=None) -> dict:
+    """
+    在一个事件循环中并发处理多个 PDF：上传 → 等待解析 → 流式总结
+
+    三个环节分别由 UPLOAD_CONCURRENCY / POLL_CONCURRENCY / STREAM_CONCURRENCY 限流，
+    等待远端解析的文件只占一个协程，数百个文件可以同时处于等待状态。
+
+    参数:
+        tasks (list): [(pdf_path, output_dir)]
+        prompt (str): 摘要生成提示语
+        on_done (callable): 可选，每篇 summary.md 写出后以 (pdf_path, output_dir) 调用，用于衔接下游阶段
+
+    返回值:
+        dict: 文件名 → None（成功）或异常对象（失败）
+    """
+    return asyncio.run(_summarize_pdfs(tasks, prompt, on_done))
@@ -82,7 +82,7 @@ def divideMD(selected, Research_object_tmp):
         dest_file = output_root / (filename + ".pdf")
         shutil.copy(src_file, dest_file)
     
-    summarize_all_documents(selected, pdf_directory, output_dir = output_root, R_object =  Research_object_tmp, max_workers = 10)
+    summarize_all_documents(selected, pdf_directory, output_dir = output_root, R_object =  Research_object_tmp, initial = 10)
         
     return  output_root
 
@@ -0,0 +1,292 @@
+# research_pipeline/ann_index.py
+"""
+IVF 近似最近邻索引（纯 numpy，CPU 运行）
+
+在编译好的向量索引（vector_index.py）之上做倒排文件（IVF-Flat）：
+    1. 用球面 k-means 训练 nlist 个粗聚类中心；
+    2. 每个段落归入最近的中心，各倒排表的向量按表连续重排存放（内存映射）；
+    3. 检索时只扫描与查询最接近的 nprobe 个倒排表。
+nprobe 是召回率 / 延迟的调节旋钮：越大越接近精确检索，越小越快。
+
+IVF 文件保存在 <文献库>/.vector_index/ivf/ 下，按向量索引的代号区分；
+文献库增量更新后沿用已训练的中心只重新分配段落，段落数翻倍后才重新训练。
+保存与清理旧文件时持有向量索引的写锁（vector_index.index_write_lock），与索引更新互斥；
+调用方持有的向量索引已不是磁盘上的最新代号时，只在内存中构建 IVF，不保存（避免旧代号覆盖并清理新代号的文件）。
+"""
+
+import os
+import json
+import time
+import threading
+import numpy as np
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from log_init import setup_logger
+from research_pipeline.vector_index import INDEX_DIRNAME, VectorIndex, current_generation, index_write_lock, normalize_rows
+
+logger = setup_logger(__name__)  # 初始化log信息
+
+IVF_DIRNAME = "ivf"
+IVF_META_FILE = "ivf.json"
+CENTROIDS_FILE = "centroids_{gen}.npy"   # (nlist, 维度) 已归一化的聚类中心
+OFFSETS_FILE = "offsets_{gen}.npy"       # (nlist + 1,) 各倒排表在 rows / vectors 中的起止位置
+ROWS_FILE = "rows_{gen}.npy"             # (段落数,) 按倒排表重排后的原索引行号
+VECTORS_FILE = "ivf_vectors_{gen}.npy"   # (段落数, 维度) 按倒排表重排后的向量
+
+KMEANS_ITERS = 10            # k-means 迭代次数
+KMEANS_SAMPLES_PER_LIST = 64 # 每个中心使用的训练样本数
+ASSIGN_BLOCK = 8192          # 分配段落时每块的行数，限制 (块行数, nlist) 分数矩阵的内存
+RETRAIN_GROWTH = 2.0         # 段落数超过训练时的该倍数后重新训练中心
+
+
+def default_nlist(n_rows: int) -> int:
+    """倒排表数量取 √N，训练与检索开销较均衡"""
+    return int(np.clip(np.sqrt(n_rows), 1, 4096))
+
+
+def _assign(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """分块计算每行最接近的中心（向量均已归一化，内积即余弦）"""
+    labels = np.empty(len(data), dtype=np.int32)
+    for i in range(0, len(data), ASSIGN_BLOCK):
+        labels[i:i + ASSIGN_BLOCK] = np.argmax(np.asarray(data[i:i + ASSIGN_BLOCK]) @ centroids.T, axis=1)
+    return labels
+
+
+def _gather(segments: List[np.ndarray], rows: np.ndarray) -> np.ndarray:
+    """
+    按全局行号从各段取出向量，直接写入预分配的结果数组
+
+    不拼接各段（避免多段时先复制出一份完整矩阵），也不整体做花式索引（避免再产生一份临时副本），
+    每次只搬运 ASSIGN_BLOCK 行。
+    """
+    dim = segments[0].shape[1] if segments else 0
+    out = np.empty((len(rows), dim), dtype=np.float32)
+    seg_starts = np.cumsum([0] + [len(seg) for seg in segments])
+    seg_of = np.searchsorted(seg_starts, rows, side="right") - 1
+    for s, seg in enumerate(segments):
+        pos = np.flatnonzero(seg_of == s)
+        for i in range(0, len(pos), ASSIGN_BLOCK):
+            block = pos[i:i + ASSIGN_BLOCK]
+            out[block] = seg[rows[block] - seg_starts[s]]
+    return out
+
+
+def train_kmeans(data: np.ndarray, nlist: int, n_iter: int = KMEANS_ITERS, seed: int = 0) -> np.ndarray:
+    """
+    球面 k-means：中心每轮按簇内均值更新后重新归一化
+
+    参数:
+        data (np.ndarray): (样本数, 维度) 已归一化的训练样本
+        nlist (int): 聚类中心数
+        n_iter (int): 迭代次数
+        seed (int): 随机种子
+
+    返回:
+        np.ndarray: (nlist, 维度) float32 聚类中心
+    """
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    nlist = min(nlist, len(data))
+    centroids = data[rng.choice(len(data), nlist, replace=False)].copy()
+
+    for _ in range(n_iter):
+        labels = _assign(data, centroids)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=nlist)
+        nonempty = np.flatnonzero(counts)
+        bounds = np.r_[0, np.cumsum(counts)][nonempty]
+        sums = np.add.reduceat(data[order], bounds, axis=0)
+        centroids[nonempty] = normalize_rows(sums)
+        # 空簇重新随机取样，避免中心浪费
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+    return centroids
+
+
+class IVFIndex:
+    """
+    IVF-Flat 近似索引
+
+    属性:
+        centroids (np.ndarray): (nlist, 维度) 聚类中心
+        offsets (np.ndarray): (nlist + 1,) 第 i 个倒排表为 rows[offsets[i]:offsets[i+1]]
+        rows (np.ndarray): 按倒排表重排后的原索引行号
+        vectors (np.ndarray): 按倒排表重排后的向量，与 rows 一一对应
+        trained_rows (int): 训练中心时的段落总数
+    """
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, rows: np.ndarray,
+                 vectors: np.ndarray, trained_rows: int):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.rows = rows
+        self.vectors = vectors
+        self.trained_rows = trained_rows
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, index: VectorIndex, nlist: Optional[int] = None,
+              centroids: Optional[np.ndarray] = None, seed: int = 0) -> "IVFIndex":
+        """
+        由向量索引构建 IVF
+
+        参数:
+            index (VectorIndex): 已编译的向量索引
+            nlist (int): 倒排表数量，默认 √N
+            centroids (np.ndarray): 可选，沿用已训练的中心（只重新分配段落，不重新训练）
+            seed (int): 随机种子
+
+        返回:
+            IVFIndex: 内存中的 IVF 索引
+        """
+        segments = index.segments
+        n_rows = len(index)
+        trained_rows = n_rows
+        if centroids is None:
+            nlist = nlist or default_nlist(n_rows)
+            rng = np.random.default_rng(seed)
+            sample_size = min(n_rows, nlist * KMEANS_SAMPLES_PER_LIST)
+            sample = _gather(segments, np.sort(rng.choice(n_rows, sample_size, replace=False)))
+            centroids = train_kmeans(sample, nlist, seed=seed)
+        else:
+            trained_rows = 0  # 由调用方填入原训练规模
+
+        # 逐段分配，多段索引不拼接出完整矩阵；重排后的向量是构建过程中唯一的一份副本
+        labels = np.empty(n_rows, dtype=np.int32)
+        offset = 0
+        for seg in segments:
+            labels[offset:offset + len(seg)] = _assign(seg, centroids)
+            offset += len(seg)
+        rows = np.argsort(labels, kind="stable").astype(np.int64)
+        offsets = np.r_[0, np.cumsum(np.bincount(labels, minlength=len(centroids)))].astype(np.int64)
+        return cls(centroids, offsets, rows, _gather(segments, rows), trained_rows)
+
+    def save(self, ivf_dir: Path, generation: int):
+        """写入该代号的 IVF 文件、切换 ivf.json 并清理旧代号文件（调用方须持有 index_write_lock）"""
+        ivf_dir.mkdir(parents=True, exist_ok=True)
+        np.save(ivf_dir / CENTROIDS_FILE.format(gen=generation), self.centroids)
+        np.save(ivf_dir / OFFSETS_FILE.format(gen=generation), self.offsets)
+        np.save(ivf_dir / ROWS_FILE.format(gen=generation), self.rows)
+        np.save(ivf_dir / VECTORS_FILE.format(gen=generation), self.vectors)
+        tmp_path = ivf_dir / (IVF_META_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"generation": generation, "nlist": self.nlist, "trained_rows": self.trained_rows}, f)
+        os.replace(tmp_path, ivf_dir / IVF_META_FILE)
+
+        # 清理旧代号文件；仍被映射而删除失败的留待下次清理
+        for path in ivf_dir.glob("*.npy"):
+            if not path.stem.endswith(f"_{generation}"):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    @classmethod
+    def load(cls, ivf_dir: Path) -> Optional[Tuple[int, "IVFIndex"]]:
+        """读取磁盘上的 IVF，返回 (对应的向量索引代号, IVFIndex)；不存在时返回 None"""
+        meta_path = ivf_dir / IVF_META_FILE
+        if not meta_path.exists():
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        gen = meta["generation"]
+        ivf = cls(
+            np.load(ivf_dir / CENTROIDS_FILE.format(gen=gen)),
+            np.load(ivf_dir / OFFSETS_FILE.format(gen=gen)),
+            np.load(ivf_dir / ROWS_FILE.format(gen=gen), mmap_mode="r"),
+            np.load(ivf_dir / VECTORS_FILE.format(gen=gen), mmap_mode="r"),
+            meta["trained_rows"],
+        )
+        return gen, ivf
+
+    def search(self, query_vec: np.ndarray, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        只扫描最接近查询的 nprobe 个倒排表
+
+        参数:
+            query_vec (np.ndarray): 查询向量，无需预先归一化
+            nprobe (int): 扫描的倒排表数量
+
+        返回:
+            (候选段落的原索引行号, 对应相似度)
+        """
+        q = normalize_rows(np.asarray(query_vec, dtype=np.float32).reshape(-1))
+        nprobe = min(max(nprobe, 1), self.nlist)
+        probe = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+        probe.sort()  # 按存放顺序读取，内存映射访问更连续
+
+        row_parts, score_parts = [], []
+        for lst in probe:
+            start, end = self.offsets[lst], self.offsets[lst + 1]
+            if start == end:
+                continue
+            row_parts.append(self.rows[start:end])
+            score_parts.append(self.vectors[start:end] @ q)
+        if not row_parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return np.concatenate(row_parts), np.concatenate(score_parts)
+
+
+# 进程内缓存：文献库目录 → (向量索引代号, IVFIndex)
+_ivf_cache = {}
+_ivf_lock = threading.Lock()
+
+
+def get_ivf(index: VectorIndex, nlist: Optional[int] = None) -> IVFIndex:
+    """
+    获取与向量索引当前代号匹配的 IVF，缺失或过期时构建并保存
+
+    参数:
+        index (VectorIndex): 已编译的向量索引（由 load_index 获得）
+        nlist (int): 需要重新训练时使用的倒排表数量，默认 √N
+
+    返回:
+        IVFIndex: 可直接检索的 IVF
+    """
+    ivf_dir = index.folder / INDEX_DIRNAME / IVF_DIRNAME
+    key = str(index.folder.resolve())
+    with _ivf_lock:
+        cached = _ivf_cache.get(key)
+        if cached is not None and cached[0] == index.generation:
+            return cached[1]
+        with index_write_lock(index.folder):
+            return _load_or_build(index, ivf_dir, key, nlist)
+
+
+def _load_or_build(index: VectorIndex, ivf_dir: Path, key: str, nlist: Optional[int]) -> IVFIndex:
+    """
+    持有索引写锁时读取磁盘上的 IVF，缺失或过期时构建、保存并清理旧代号文件
+
+    index 已落后于磁盘上的向量索引代号（其他线程 / 进程在此期间更新了索引）时，
+    构建的 IVF 只返回给调用方，不保存也不缓存
+    """
+    latest = current_generation(index.folder)
+    stale = latest is not None and index.generation < latest
+    loaded = IVFIndex.load(ivf_dir)
+    if loaded is not None and loaded[0] == index.generation:
+        _ivf_cache[key] = loaded
+        return loaded[1]
+
+    t0 = time.perf_counter()
+    if loaded is not None and len(index) <= loaded[1].trained_rows * RETRAIN_GROWTH:
+        # 文献库小幅增量更新：沿用已训练的中心，只重新分配段落
+        old = loaded[1]
+        ivf = IVFIndex.build(index, centroids=np.asarray(old.centroids))
+        ivf.trained_rows = old.trained_rows
+        action = "重新分配"
+    else:
+        ivf = IVFIndex.build(index, nlist=nlist)
+        action = "训练"
+    if stale:
+        logger.info(f"[IVF] 向量索引代号 {index.generation} 已过期（最新 {latest}），本次{action}的 IVF 不保存")
+        return ivf
+    ivf.save(ivf_dir, index.generation)
+    logger.info(f"[IVF] 已{action} {ivf.nlist} 个倒排表 / {len(index)} 个段落，用时 {time.perf_counter() - t0:.1f}s")
+
+    _ivf_cache[key] = (index.generation, ivf)
+    return ivf
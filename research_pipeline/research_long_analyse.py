@@ -1,53 +1,50 @@
 from importlib.machinery import PathFinder
-import os
 from pathlib import Path
 from datetime import datetime
-from openai import OpenAI
+from utils.api_clients import get_openai_client
+from utils.rate_limit import call_with_retry, estimate_tokens
+from utils import file_registry, response_cache
+from utils.atomic_io import atomic_write_text
+from pipeline.summarize_with_qwen_long import wait_for_file_ready
 from typing import List
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import as_completed
+from utils.concurrency import AdaptiveExecutor
 from prompts import devide_prompt
 from log_init import setup_logger 
 
 logger = setup_logger(__name__)  # 初始化log信息
 
-def process_single_pdf(document_name: str, pdf_dir: Path, output_root: Path, R_object: str) -> str:
+LONG_MODEL = "qwen-long"
+SYSTEM_PROMPT = '你是一个具有通信领域专业背景的研究助手，请你参考专业知识协助我进行文献整理'
+
+def generate_summary(client, pdf_path: Path, user_prompt: str) -> str:
     """
-    对单个 PDF 进行上传、总结，并输出 Markdown 文件。
+    上传 PDF（或复用已登记的 file_id）并调用 qwen-long 生成总结
 
     参数:
-        document_name (str): PDF 文件名（不含扩展名）。
-        pdf_dir (Path): 存放 PDF 文件的目录路径。
-        output_root (Path): 输出 Markdown 文件的根目录路径。
-        R_object (str): 研究对象名称，用于构建提示词。
+        client: 共享的 Qwen 客户端
+        pdf_path (Path): PDF 文件路径
+        user_prompt (str): 总结提示词
 
     返回:
-        str: 日志信息字符串，表示处理过程中的状态或错误信息。
+        str: 模型输出的完整文本
     """
-    Research_object = R_object
-    # 初始化 Qwen 客户端
-    client = OpenAI(
-        api_key=os.getenv("QWEN_API_KEY"),
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-    )
-
-    pdf_path = pdf_dir / f"{document_name}.pdf"
-    if not pdf_path.exists():
-        logger.error(f"[跳过] 文件不存在: {pdf_path}")
-        return f"[跳过] 文件不存在: {pdf_path}"
-
-    try:
-        # 上传 PDF 文件
-        file_obj = client.files.create(file=pdf_path, purpose="file-extract")  # type: ignore
-        file_id = file_obj.id
-        logger.info(f"[上传成功] {document_name} → file-id: {file_id}")
-
-        # 调用 qwen-long 进行内容总结
+    # 上传 PDF 文件：入库时已上传过且仍有效的直接复用 file_id，已解析完成的无需再等待
+    file_id, ready = file_registry.get_or_upload(client, pdf_path)
+    logger.info(f"[上传成功] {pdf_path.stem} → file-id: {file_id}")
+    if not ready:
+        if not wait_for_file_ready(client, file_id):
+            raise Exception(f"文件 {pdf_path.name} 长时间未解析成功，跳过。")
+        file_registry.mark_processed(file_id)
+
+    # 调用 qwen-long 进行内容总结
+    def generate():
         completion = client.chat.completions.create(
-            model="qwen-long",
+            model=LONG_MODEL,
             messages=[
-                {'role': 'system', 'content': '你是一个具有通信领域专业背景的研究助手，请你参考专业知识协助我进行文献整理'},
+                {'role': 'system', 'content': SYSTEM_PROMPT},
                 {'role': 'system', 'content': f'fileid://{file_id}'},
-                {'role': 'user', 'content': devide_prompt.format(Research_object=Research_object)}
+                {'role': 'user', 'content': user_prompt}
             ],
             stream=True,
             stream_options={"include_usage": True}
@@ -58,26 +55,74 @@ def process_single_pdf(document_name: str, pdf_dir: Path, output_root: Path, R_o
         for chunk in completion:
             if chunk.choices and chunk.choices[0].delta.content:
                 full_content += chunk.choices[0].delta.content
+        return full_content
 
-        # 修复 long 模型不会转换 latex 标识符的问题
-        full_content = full_content.replace('\\[', '$').replace('\\]', '$')
+    # 流式输出中途断开时整段重新生成
+    return call_with_retry("qwen", generate, tokens=estimate_tokens(user_prompt))
 
-        # 保存为 Markdown 文件
-        md_path = output_root / f"{document_name}.md"
-        with open(md_path, "w", encoding="utf-8") as f:
-            f.write(f"# 论文总结 - {document_name}\n\n")
-            f.write(full_content.strip())
+def process_single_pdf(document_name: str, pdf_dir: Path, output_root: Path, R_object: str) -> str:
+    """
+    对单个 PDF 进行上传、总结，并输出 Markdown 文件。
 
-        success_msg = f"[完成] {document_name} 总结保存至 {md_path.name}"
-        logger.info(success_msg)
-        return success_msg
+    参数:
+        document_name (str): PDF 文件名（不含扩展名）。
+        pdf_dir (Path): 存放 PDF 文件的目录路径。
+        output_root (Path): 输出 Markdown 文件的根目录路径。
+        R_object (str): 研究对象名称，用于构建提示词。
 
+    返回:
+        str: 日志信息字符串，表示处理过程中的状态或错误信息。
+    """
+    try:
+        return summarize_document(document_name, pdf_dir, output_root, R_object)
     except Exception as e:
-        error_msg = f"[错误] {document_name} 处理失败: {e}"
-        logger.error(error_msg)
-        return error_msg  # 确保异常时也返回字符串
+        return _failure_message(document_name, e)  # 确保异常时也返回字符串
+
+def _failure_message(document_name: str, error: Exception) -> str:
+    error_msg = f"[错误] {document_name} 处理失败: {error}"
+    logger.error(error_msg)
+    return error_msg
+
+def summarize_document(document_name: str, pdf_dir: Path, output_root: Path, R_object: str) -> str:
+    """
+    process_single_pdf 的实际实现：处理失败时抛出异常（供 AdaptiveExecutor 统计错误率）
+
+    返回:
+        str: 完成或跳过（文件不存在）的日志信息
+    """
+    Research_object = R_object
+    # 获取共享的 Qwen 客户端（多线程复用连接池）
+    client = get_openai_client("qwen")
+
+    pdf_path = pdf_dir / f"{document_name}.pdf"
+    if not pdf_path.exists():
+        logger.error(f"[跳过] 文件不存在: {pdf_path}")
+        return f"[跳过] 文件不存在: {pdf_path}"
 
-def summarize_all_documents(document_list: List[str], pdf_dir: Path,  output_dir: Path  , R_object: str, max_workers: int = 4 ):
+    # 同一文献、同一调研主题的总结已生成过时直接复用，无需上传
+    user_prompt = devide_prompt.format(Research_object=Research_object)
+    cache_key = response_cache.make_key("chat", "qwen", LONG_MODEL, document=file_registry.file_sha256(pdf_path),
+                                        system=SYSTEM_PROMPT, prompt=user_prompt)
+    full_content = response_cache.get(cache_key)
+    if full_content is not None:
+        logger.info(f"[缓存] {document_name} 命中总结缓存")
+    else:
+        full_content = generate_summary(client, pdf_path, user_prompt)
+        response_cache.put(cache_key, full_content)
+
+    # 修复 long 模型不会转换 latex 标识符的问题
+    full_content = full_content.replace('\\[', '$').replace('\\]', '$')
+
+    # 保存为 Markdown 文件
+    md_path = output_root / f"{document_name}.md"
+    atomic_write_text(md_path, f"# 论文总结 - {document_name}\n\n" + full_content.strip())
+
+    success_msg = f"[完成] {document_name} 总结保存至 {md_path.name}"
+    logger.info(success_msg)
+    return success_msg
+
+def summarize_all_documents(document_list: List[str], pdf_dir: Path,  output_dir: Path  , R_object: str,
+                            max_workers: int = None, initial: int = None ): # type: ignore
     """
     多线程方式并发处理文档列表中的所有文档
     
@@ -86,20 +131,24 @@ def summarize_all_documents(document_list: List[str], pdf_dir: Path,  output_dir
         pdf_dir (Path): PDF文档所在的目录路径
         output_dir (Path): 处理结果输出的目录路径
         R_object (str): 处理过程中需要使用的R对象名称
-        max_workers (int): 最大并发线程数，默认为4
+        max_workers (int): 可选，并发数的上界；实际并发数由 AdaptiveExecutor 按服务端状况自动调节
+        initial (int): 可选，初始并发数（通义 limiter 尚未创建时生效）
     
     返回值:
         无返回值，处理结果会输出到指定目录并打印处理状态
     """
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    with AdaptiveExecutor("qwen", max_workers, initial, workload="research_summary") as executor:
+        # 任务失败时抛出异常，由执行器计入错误率后在此转换为日志信息
         future_to_doc = {
-            executor.submit(process_single_pdf, doc, pdf_dir, output_dir,R_object): doc
+            executor.submit(summarize_document, doc, pdf_dir, output_dir,R_object): doc
             for doc in document_list
         }
 
         for future in as_completed(future_to_doc):
-            if future.result() is not None:
+            try:
                 print(future.result())
+            except Exception as e:
+                print(_failure_message(future_to_doc[future], e))
 
 if __name__ == "__main__":
     # 示例输入：请替换为实际 PDF 文件名（无扩展名）
@@ -115,7 +164,7 @@ if __name__ == "__main__":
     output_root = Path("research_output") / today
     output_root.mkdir(parents=True, exist_ok=True)
 
-    summarize_all_documents(example_documents, pdf_directory, max_workers=8, output_dir = output_root, R_object = Research_object)
+    summarize_all_documents(example_documents, pdf_directory, output_dir = output_root, R_object = Research_object)
 
 
 
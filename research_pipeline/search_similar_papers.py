@@ -1,53 +1,58 @@
 # search_similar_papers.py
 
-import os
 import json
 import numpy as np
 from pathlib import Path
-from openai import OpenAI
 from dotenv import load_dotenv
-from typing import List, Tuple
-import requests
+from typing import List, Optional, Tuple
+from utils.api_clients import get_openai_client
+from utils.rate_limit import call_with_retry, estimate_tokens, post_json
+from utils import response_cache
 from pipeline.get_embedding_bgem3 import get_embedding_bge_m3
+from pipeline.embedding_server import get_embedding_from_server
+from research_pipeline.vector_index import VectorIndex, load_index
+from research_pipeline.ann_index import get_ivf
 
 load_dotenv()
-Embedding_Model_select = 2 # 1-qwen embedding3（百炼）  2- BGE-M3(本地)  3-BGE-M3(硅基)
+Embedding_Model_select = 2 # 1-qwen embedding3（百炼）  2- BGE-M3(本地)  3-BGE-M3(硅基)  4-BGE-M3(本地共享服务)
+QUERY_BATCH_SIZE = {1: 10, 2: 32, 3: 32, 4: 32}  # 各模型单次请求的最大文本条数（百炼 text-embedding-v3 上限为 10）
+SCORE_BLOCK_SIZE = 64  # 批量检索时每次参与矩阵乘法的查询数，限制 (段落数, 查询数) 分数矩阵的内存占用
+Search_Backend = "exact"  # "exact"-精确检索  "ivf"-IVF 近似检索（见 ann_index.py）
+IVF_NPROBE = 16           # IVF 每条查询扫描的倒排表数量：越大召回越高、越慢
+IVF_MIN_CHUNKS = 20000    # 段落数低于该值时 IVF 自动回退为精确检索（小文献库精确检索已足够快）
 
 # 百炼Qwen3 embedding3 模型
 def get_query_embedding(query: str) -> np.ndarray:
-    client = OpenAI(
-            api_key=os.getenv("QWEN_API_KEY"),
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
+    return get_query_embeddings([query])[0]
+
+def get_query_embeddings(queries: List[str]) -> np.ndarray:
+    """百炼 embedding3 批量接口，一次请求返回多条查询的向量"""
+    def compute():
+        client = get_openai_client("qwen")
+        response = call_with_retry("qwen", client.embeddings.create,
+            input=queries,
+            model="text-embedding-v3",
+            tokens=estimate_tokens(queries)
         )
-    response = client.embeddings.create(
-        input=query,
-        model="text-embedding-v3"
-    )
-    return np.array(response.data[0].embedding)
+        return [item.embedding for item in response.data]
+
+    return np.array(response_cache.cached(compute, "embedding", "qwen", "text-embedding-v3", input=queries))
 
 def get_query_embedding_bgem3(query:str) :
     url = "https://api.siliconflow.cn/v1/embeddings"
-    api_key=os.getenv("SOLID_API_KRY")
 
     payload = {
         "model": "BAAI/bge-m3",
         "input": query,
         "encoding_format": "float"
     }
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
 
-    response = requests.request("POST", url, json=payload, headers=headers)
-    if response.status_code == 200:
-        response_json = response.json()
+    def compute():
+        response_json = post_json("siliconflow", url, payload, tokens=estimate_tokens(query))
         # 提取所有 embedding
-        embeddings = [item["embedding"] for item in response_json["data"]]
-    else:
-        print("Error:", response.status_code, response.text)
-        embeddings = []
-    return embeddings
+        return [item["embedding"] for item in response_json["data"]]
+
+    return response_cache.cached(compute, "embedding", "siliconflow", payload["model"], payload=payload)
 
 
 # 余弦相似运算
@@ -82,43 +87,206 @@ def load_all_embeddings(folder: Path) -> List[Tuple[str, str, List[Tuple[str, np
 
     return results
 
-def search_similar(query: str, data_folder: str, top_k: int = 5) -> List[dict]:
+def embed_queries(queries: List[str]) -> np.ndarray:
+    """
+    按 Embedding_Model_select 选择的模型批量生成查询向量
+
+    按模型单次请求的条数上限分批，每批一次模型前向 / 一次 API 请求。
+
+    返回:
+        np.ndarray: (查询数, 维度) 的查询向量矩阵
+    """
+    batch_size = QUERY_BATCH_SIZE[Embedding_Model_select]
+    parts = []
+    for i in range(0, len(queries), batch_size):
+        group = queries[i:i + batch_size]
+        if Embedding_Model_select == 1:
+            parts.append(get_query_embeddings(group))
+        elif Embedding_Model_select == 2:
+            embedding_tensor = get_embedding_bge_m3(group)
+            parts.append(np.array(embedding_tensor.cpu().tolist()))
+        elif Embedding_Model_select == 3:
+            query_vec_list = get_query_embedding_bgem3(group) # type: ignore
+            if len(query_vec_list) != len(group):
+                raise RuntimeError(f"BGE-M3(硅基) 返回 {len(query_vec_list)} 条向量，预期 {len(group)} 条")
+            parts.append(np.array(query_vec_list))
+        elif Embedding_Model_select == 4:
+            parts.append(np.array(get_embedding_from_server(group)))
+    return np.vstack(parts)
+
+def embed_query(query: str) -> np.ndarray:
+    """按 Embedding_Model_select 选择的模型生成单条查询向量"""
+    return embed_queries([query])[0]
+
+def _select_top_k(values: np.ndarray, top_k: int) -> List[Tuple[int, float]]:
+    """
+    argpartition 部分选择出候选，只对少量候选按四舍五入后的分数稳定排序，
+    结果与"全部排序后取前 k 个"完全一致（同分按 values 中的先后顺序）
+
+    返回:
+        [(values 中的下标, 分数(保留4位小数))]
+    """
+    if top_k < len(values):
+        # 四舍五入最多改变 5e-5，分数低于第 k 名超过 1e-4 的项不可能进入前 k
+        kth = values[np.argpartition(-values, top_k - 1)[top_k - 1]]
+        candidates = np.flatnonzero(values >= kth - 1e-4)
+    else:
+        candidates = np.arange(len(values))
+    rounded = [round(float(v), 4) for v in values[candidates]]
+    order = sorted(range(len(candidates)), key=lambda i: rounded[i], reverse=True)[:top_k]
+    return [(int(candidates[i]), rounded[i]) for i in order]
+
+def rank_documents(index: VectorIndex, scores: np.ndarray, top_k: int,
+                   run_max: Optional[np.ndarray] = None) -> List[Tuple[int, float, int]]:
+    """
+    由一条查询对全部段落的分数得到前 top_k 篇论文
+
+    1. 按论文分组取段落最高分（同一论文的行连续存放，np.maximum.reduceat 一次完成）；
+    2. argpartition 部分选择出候选，只对少量候选按四舍五入后的分数稳定排序，
+       结果与"全部论文排序后取前 k 篇"完全一致（同分按索引中的先后顺序）；
+    3. 只为入选论文定位最相关段落所在的行。
+
+    参数:
+        index (VectorIndex): 向量索引
+        scores (np.ndarray): (段落数,) 该查询对全部段落的相似度
+        top_k (int): 返回论文数量
+        run_max (np.ndarray): 可选，已算好的每个 run 的最高分（批量检索时整块计算）
+
+    返回:
+        List[Tuple[int, float, int]]: [(论文编号, 相似度(保留4位小数), 最相关段落行号)]
+    """
+    if top_k <= 0:
+        return []
+    starts, ends, run_docs, live_runs = index.doc_runs
+    if run_max is None:
+        run_max = np.maximum.reduceat(scores, starts)
+    values = run_max[live_runs]
+    if len(values) == 0:
+        return []
+
+    results = []
+    for i, similarity in _select_top_k(values, top_k):
+        run = live_runs[i]
+        start, end = starts[run], ends[run]
+        best_row = int(start + np.argmax(scores[start:end]))
+        results.append((int(run_docs[run]), similarity, best_row))
+    return results
+
+def rank_candidates(index: VectorIndex, rows: np.ndarray, scores: np.ndarray,
+                    top_k: int) -> List[Tuple[int, float, int]]:
+    """
+    由近似检索扫描到的候选段落得到前 top_k 篇论文
+
+    只处理候选行（按论文分组取最高分），开销与扫描到的段落数成正比，与文献库规模无关；
+    排序与同分规则和 rank_documents 相同（论文编号顺序即论文在索引中的先后顺序）。
+
+    参数:
+        index (VectorIndex): 向量索引
+        rows (np.ndarray): 候选段落的行号（IVFIndex.search 的返回值）
+        scores (np.ndarray): 候选段落的相似度
+        top_k (int): 返回论文数量
+
+    返回:
+        List[Tuple[int, float, int]]: [(论文编号, 相似度(保留4位小数), 最相关段落行号)]
+    """
+    if top_k <= 0 or len(rows) == 0:
+        return []
+    doc_ids = np.asarray(index.doc_ids[rows])
+    live = index.alive[doc_ids]
+    rows, scores, doc_ids = rows[live], scores[live], doc_ids[live]
+    if len(rows) == 0:
+        return []
+
+    # 按论文分组，组内分数从高到低（同分取行号小的，与 np.argmax 一致），每组第一行即该论文的最相关段落
+    order = np.lexsort((rows, -scores, doc_ids))
+    grouped_docs = doc_ids[order]
+    firsts = order[np.flatnonzero(np.r_[True, grouped_docs[1:] != grouped_docs[:-1]])]
+    return [(int(doc_ids[firsts[i]]), similarity, int(rows[firsts[i]]))
+            for i, similarity in _select_top_k(scores[firsts], top_k)]
+
+def search_similar_batch(queries: List[str], data_folder: str, top_k: int = 5,
+                         backend: Optional[str] = None, nprobe: Optional[int] = None) -> List[List[dict]]:
+    """
+    批量匹配多条查询（如每周的课题扫描），返回与 queries 一一对应的结果列表。
+
+    全部查询先分批生成向量，再与索引做矩阵-矩阵乘法统一打分，文献库只扫描一遍；
+    每条查询的结果格式与 search_similar 相同（document / similarity / best_paragraph）。
+
+    参数:
+        backend (str): "exact" 或 "ivf"，默认取 Search_Backend；段落数少于 IVF_MIN_CHUNKS 时总是精确检索
+        nprobe (int): IVF 扫描的倒排表数量，默认取 IVF_NPROBE
+    """
+    if not queries:
+        return []
+    query_mat = embed_queries(list(queries))
+
+    index = load_index(Path(data_folder))
+    if len(index) == 0:
+        return [[] for _ in queries]
+
+    backend = backend or Search_Backend
+    text_cache = {}  # 多条查询命中同一论文时只解析一次 JSON
+    results = []
+    if backend == "ivf" and len(index) >= IVF_MIN_CHUNKS:
+        ivf = get_ivf(index)
+        nprobe = nprobe or IVF_NPROBE
+        for query_vec in query_mat:
+            # 只对扫描到的段落分组排序；未被扫描到的论文不作为结果
+            rows, scores = ivf.search(query_vec, nprobe)
+            results.append(_collect_results(
+                index, lambda k: rank_candidates(index, rows, scores, k), top_k, text_cache))
+    else:
+        starts = index.doc_runs[0]
+        for i in range(0, len(query_mat), SCORE_BLOCK_SIZE):
+            scores = index.score_batch(query_mat[i:i + SCORE_BLOCK_SIZE])
+            run_max = np.maximum.reduceat(scores, starts, axis=0)
+            for col in range(scores.shape[1]):
+                results.append(_collect_results(
+                    index, lambda k: rank_documents(index, scores[:, col], k, run_max[:, col]), top_k, text_cache))
+    return results
+
+def _collect_results(index: VectorIndex, rank, top_k: int, text_cache: dict) -> List[dict]:
+    """
+    按排名取回最相关段落，组装一条查询的结果
+
+    JSON 已被删除或无法读取的论文（索引尚未同步）跳过，并用排名其后的论文补足 top_k 篇；
+    段落原文为空的论文照常返回。
+
+    参数:
+        rank: rank(k) 返回该查询前 k 篇论文 [(论文编号, 相似度, 最相关段落行号)]
+        text_cache (dict): 论文名 → 段落文本列表，见 VectorIndex.chunk_text
+    """
+    if top_k <= 0:
+        return []
+    k = top_k
+    while True:
+        ranked = rank(k)
+        matches = []
+        for doc_id, similarity, row in ranked:
+            paragraph = index.chunk_text(row, text_cache)
+            if paragraph is None:
+                continue
+            matches.append({
+                "document": index.docs[doc_id],
+                "similarity": similarity,
+                "best_paragraph": paragraph
+            })
+            if len(matches) == top_k:
+                return matches
+        if len(ranked) < k:  # 候选论文已取尽
+            return matches
+        k += top_k - len(matches)
+
+def search_similar(query: str, data_folder: str, top_k: int = 5,
+                   backend: Optional[str] = None, nprobe: Optional[int] = None) -> List[dict]:
     """
     calling by streamlit_main.py
     对给定查询进行匹配，返回结构化结果。
     每个结果包含：论文名、相似度、最相关段落。
+    向量来自编译好的内存映射索引（见 vector_index.py），一次矩阵乘法完成全部段落打分；
+    backend="ivf" 时只扫描 nprobe 个倒排表（近似检索）。
     """
-    # query_vec = get_query_embedding(query)
-    if Embedding_Model_select == 1:
-        query_vec = get_query_embedding(query)
-    elif Embedding_Model_select == 2:
-        embedding_tensor = get_embedding_bge_m3(query)
-        query_vec = np.array(embedding_tensor.cpu().tolist())
-    elif Embedding_Model_select == 3:
-        query_vec_list = get_query_embedding_bgem3(query)
-        # get_query_embedding_bgem3 returns a list of embeddings, use the first one
-        query_vec = np.array(query_vec_list[0]) if query_vec_list else np.array([])
-    
-    papers = load_all_embeddings(Path(data_folder))
-
-    scored = []
-    for name, preview, vec_list in papers:
-        best_score = -1.0
-        best_text = ""
-        for para_text, vec in vec_list:
-            score = cosine_similarity(query_vec, vec)
-            if score > best_score:
-                best_score = score
-                best_text = para_text
-        scored.append({
-            "document": name,
-            "similarity": round(float(best_score), 4),
-            "best_paragraph": best_text
-        })
-
-    # 排序后返回 top_k 个结果
-    scored.sort(key=lambda x: x["similarity"], reverse=True)
-    return scored[:top_k]
+    return search_similar_batch([query], data_folder, top_k, backend, nprobe)[0]
 
 
 if __name__ == "__main__":
@@ -1,5 +1,6 @@
-import os
-from openai import OpenAI
+from utils.api_clients import get_openai_client
+from utils.rate_limit import call_with_retry, estimate_tokens
+from utils import response_cache
 from typing import List
 from prompts import final_prompt
 
@@ -15,10 +16,7 @@ def submit_summary_to_qwen(Research_object: str, markdown_chunks: List[str]) ->
     Returns:
         str: 调研报告的 Markdown 格式文本
     """
-    client = OpenAI(
-    api_key=os.getenv("QWEN_API_KEY"),
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-    )   
+    client = get_openai_client("qwen")
     merged_md = "\n\n".join(markdown_chunks)
 
     # 构建Prompt
@@ -35,13 +33,19 @@ def submit_summary_to_qwen(Research_object: str, markdown_chunks: List[str]) ->
             """
     user_prompt = user_prompt + final_prompt
 
+    messages = [
+        {'role': 'system', 'content': '你是一个科研分析助手，请以Markdown格式输出调研报告。'},
+        {'role': 'user', 'content': user_prompt}
+    ]
+
     # 发起 API 请求
-    completion = client.chat.completions.create(
-        model="qwen-max-latest",
-        messages=[
-            {'role': 'system', 'content': '你是一个科研分析助手，请以Markdown格式输出调研报告。'},
-            {'role': 'user', 'content': user_prompt}
-        ]
-    )
-
-    return completion.choices[0].message.content # type: ignore
+    def generate():
+        completion = call_with_retry("qwen", client.chat.completions.create,
+            model="qwen-max-latest",
+            messages=messages,
+            tokens=estimate_tokens(user_prompt)
+        )
+        return completion.choices[0].message.content
+
+    # 同一主题、同一批论文内容重新生成报告时直接读取缓存
+    return response_cache.cached(generate, "chat", "qwen", "qwen-max-latest", messages=messages) # type: ignore
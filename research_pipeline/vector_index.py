@@ -0,0 +1,519 @@
+# research_pipeline/vector_index.py
+"""
+文献库向量索引
+
+将文献库目录下每篇论文的 <paper>.json 中的段落向量编译为连续的、预先归一化的
+float32 矩阵，以 .npy 形式保存在 <文献库>/.vector_index/ 下，并通过内存映射加载。
+检索时只需对该矩阵做一次矩阵-向量乘法，不再逐个解析 JSON。
+
+索引由若干只读的段（segment）组成。update_index 依据文件清单（manifest，记录每个 JSON
+的大小、修改时间与内容哈希）只处理新增 / 变化 / 删除的论文：新增论文写入新段，变化的
+论文给旧记录打墓碑后重新追加，删除的论文只打墓碑；墓碑过多或段过多时再合并压缩。
+
+写入方只有入库流程（update_index，持有 .vector_index/.lock 跨进程文件锁）；
+检索端（load_index）只读，打开段文件时若恰逢合并压缩删除了旧段，则重新读取 meta.json 后重试。
+"""
+
+import os
+import json
+import hashlib
+import time
+import threading
+import numpy as np
+from contextlib import contextmanager
+from functools import cached_property
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from log_init import setup_logger
+from utils.file_lock import file_lock
+
+logger = setup_logger(__name__)  # 初始化log信息
+
+INDEX_DIRNAME = ".vector_index"
+# 段文件一经写入不再修改，更新时写新段再切换 meta.json，
+# 避免覆盖仍被其他进程内存映射着的旧文件（Windows 下无法替换已映射的文件）
+VECTORS_FILE = "vectors_{seg}.npy"      # (段落数, 维度) float32，已按行归一化
+DOC_IDS_FILE = "doc_ids_{seg}.npy"      # (段落数,) int32，每行所属论文编号
+CHUNK_IDS_FILE = "chunk_ids_{seg}.npy"  # (段落数,) int32，每行在原 JSON 中的段落序号
+META_FILE = "meta.json"                 # 段列表、论文表（含墓碑标记）与文件清单，最后写入
+LOCK_FILE = ".lock"                     # 跨进程写锁，读 meta → 写段 → 切换 meta → 清理旧段全程持有
+
+COMPACT_DEAD_RATIO = 0.25   # 墓碑段落占比超过该值时合并压缩
+COMPACT_MAX_SEGMENTS = 8    # 段数超过该值时合并压缩
+
+OPEN_RETRIES = 5            # 打开索引时段文件被并发的合并压缩删除后，重新读取 meta 重试的次数
+OPEN_RETRY_DELAY = 0.05     # 重试间隔（秒）
+
+_update_lock = threading.Lock()  # 同一进程内的索引更新串行执行
+
+
+def read_embedding_file(file: Path) -> Optional[Tuple[List[str], List[list]]]:
+    """
+    读取单篇论文的 embedding JSON
+
+    参数:
+        file (Path): <paper>.json 文件路径
+
+    返回:
+        (段落文本列表, 向量列表)；若文件中没有可识别的向量字段则返回 None
+    """
+    with open(file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    if "embeddings" in data:
+        # 多段嵌入格式
+        items = data["embeddings"]
+        return [item["text"] for item in items], [item["embedding"] for item in items]
+    elif "embedding" in data:
+        # 向后兼容单段格式
+        return [data.get("text", "")], [data["embedding"]]
+    return None
+
+
+def normalize_rows(mat: np.ndarray) -> np.ndarray:
+    """按行做 L2 归一化，零向量保持为零"""
+    norms = np.linalg.norm(mat, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+def _file_sha256(file: Path) -> str:
+    h = hashlib.sha256()
+    with open(file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+@contextmanager
+def index_write_lock(folder: Path):
+    """
+    索引写锁：进程内线程锁 + .vector_index/.lock 跨进程文件锁
+
+    所有修改 .vector_index/ 下文件的操作（update_index、IVF 近似索引的保存与清理）都须持有该锁，
+    否则两个进程各自清理"未被自己的 meta 引用"的文件时会删掉对方刚写入的段。
+    """
+    index_dir = Path(folder) / INDEX_DIRNAME
+    with _update_lock, file_lock(index_dir / LOCK_FILE):
+        yield
+
+
+def _read_meta(index_dir: Path) -> Optional[dict]:
+    meta_path = index_dir / META_FILE
+    if not meta_path.exists():
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def current_generation(folder: Path) -> Optional[int]:
+    """磁盘上向量索引的当前代号；索引尚不存在时返回 None"""
+    meta = _read_meta(Path(folder) / INDEX_DIRNAME)
+    return meta["generation"] if meta is not None else None
+
+
+def _write_meta(index_dir: Path, meta: dict):
+    """先写临时文件再替换，检索端只会看到完整的 meta.json"""
+    tmp_path = index_dir / (META_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, index_dir / META_FILE)
+
+
+def _remove_unused_segments(index_dir: Path, segments: List[int]):
+    """清理不再被 meta.json 引用的段文件；仍被映射而删除失败的留待下次清理"""
+    keep = {str(seg) for seg in segments}
+    for path in index_dir.glob("*_*.npy"):
+        if path.stem.rsplit("_", 1)[-1] in keep:
+            continue
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+def _write_segment(index_dir: Path, seg: int, vectors: np.ndarray, doc_ids: np.ndarray, chunk_ids: np.ndarray):
+    np.save(index_dir / VECTORS_FILE.format(seg=seg), vectors.astype(np.float32, copy=False))
+    np.save(index_dir / DOC_IDS_FILE.format(seg=seg), doc_ids.astype(np.int32, copy=False))
+    np.save(index_dir / CHUNK_IDS_FILE.format(seg=seg), chunk_ids.astype(np.int32, copy=False))
+
+
+def _load_segment(index_dir: Path, seg: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    return (
+        np.load(index_dir / VECTORS_FILE.format(seg=seg), mmap_mode="r"),
+        np.load(index_dir / DOC_IDS_FILE.format(seg=seg), mmap_mode="r"),
+        np.load(index_dir / CHUNK_IDS_FILE.format(seg=seg), mmap_mode="r"),
+    )
+
+
+class VectorIndex:
+    """
+    已编译的文献向量索引
+
+    属性:
+        folder (Path): 文献库目录
+        segments (List[np.ndarray]): 各段的 (段落数, 维度) float32 内存映射矩阵，已归一化
+        doc_ids (np.ndarray): 各段拼接后每行所属论文在 docs 中的下标，同一论文的行连续存放
+        chunk_ids (np.ndarray): 每行在原 JSON "embeddings" 列表中的序号
+        docs (List[str]): 论文名（JSON 文件名去掉扩展名），按论文编号排列
+        alive (np.ndarray): 每篇论文是否有效；被删除或被新版本替换的论文为 False（墓碑）
+        generation (int): 索引代号，每次更新递增；派生结构（如 IVF 近似索引）据此判断是否过期
+    """
+
+    def __init__(self, folder: Path, segments: List[np.ndarray], doc_ids: np.ndarray,
+                 chunk_ids: np.ndarray, docs: List[str], alive: np.ndarray, generation: int = 0):
+        self.folder = folder
+        self.segments = segments
+        self.doc_ids = doc_ids
+        self.chunk_ids = chunk_ids
+        self.docs = docs
+        self.alive = alive
+        self.generation = generation
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    @property
+    def dim(self) -> int:
+        return self.segments[0].shape[1] if self.segments else 0
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """全部段落向量；只有一个段时直接返回内存映射，否则拼接出一份副本"""
+        if len(self.segments) == 1:
+            return self.segments[0]
+        if not self.segments:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(self.segments)
+
+    @cached_property
+    def doc_runs(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        同一论文的段落在索引中连续存放，每段连续行称为一个 run
+
+        返回:
+            (每个 run 的起始行, 结束行(不含), 所属论文编号, 有效论文对应的 run 下标)
+        """
+        doc_ids = np.asarray(self.doc_ids)
+        starts = np.flatnonzero(np.r_[True, doc_ids[1:] != doc_ids[:-1]])
+        ends = np.r_[starts[1:], len(doc_ids)]
+        run_docs = doc_ids[starts]
+        live_runs = np.flatnonzero(self.alive[run_docs])
+        return starts, ends, run_docs, live_runs
+
+    def score(self, query_vec: np.ndarray) -> np.ndarray:
+        """
+        计算查询向量与所有段落的余弦相似度
+
+        参数:
+            query_vec (np.ndarray): 查询向量，无需预先归一化
+
+        返回:
+            np.ndarray: (段落数,) 的相似度数组（含墓碑段落，由调用方按 alive 过滤）
+        """
+        q = normalize_rows(np.asarray(query_vec, dtype=np.float32).reshape(-1))
+        return np.concatenate([seg @ q for seg in self.segments])
+
+    def score_batch(self, query_mat: np.ndarray) -> np.ndarray:
+        """
+        一次矩阵-矩阵乘法计算多条查询与所有段落的余弦相似度
+
+        参数:
+            query_mat (np.ndarray): (查询数, 维度) 的查询向量矩阵，无需预先归一化
+
+        返回:
+            np.ndarray: (段落数, 查询数) 的相似度矩阵
+        """
+        q = normalize_rows(np.asarray(query_mat, dtype=np.float32).reshape(-1, self.dim))
+        return np.concatenate([seg @ q.T for seg in self.segments])
+
+    def chunk_text(self, row: int, cache: Optional[dict] = None) -> Optional[str]:
+        """
+        按需从原 JSON 中取回某一行对应的段落原文（只在展示结果时调用）
+
+        参数:
+            row (int): 索引中的行号
+            cache (dict): 可选，论文名 → 段落文本列表；批量取回时避免重复解析同一 JSON
+
+        返回:
+            str: 段落原文（可能为空，如只有单个 "embedding" 字段的旧格式 JSON，或 chunk_id 越界）；
+                 JSON 已被删除或无法读取（索引尚未同步）时返回 None
+        """
+        doc = self.docs[int(self.doc_ids[row])]
+        if cache is not None and doc in cache:
+            texts = cache[doc]
+        else:
+            try:
+                parsed = read_embedding_file(self.folder / f"{doc}.json")
+                texts = parsed[0] if parsed is not None else []
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"[索引] {doc}.json 缺失或无法读取（{type(e).__name__}），索引尚未同步，检索结果跳过该论文")
+                texts = None
+            if cache is not None:
+                cache[doc] = texts
+        if texts is None:
+            return None
+        chunk_id = int(self.chunk_ids[row])
+        return texts[chunk_id] if chunk_id < len(texts) else ""
+
+
+def _open_index(folder: Path, meta: dict) -> VectorIndex:
+    """以内存映射方式打开磁盘上的索引"""
+    index_dir = folder / INDEX_DIRNAME
+    segments, doc_id_parts, chunk_id_parts = [], [], []
+    for seg in meta["segments"]:
+        vectors, doc_ids, chunk_ids = _load_segment(index_dir, seg)
+        segments.append(vectors)
+        doc_id_parts.append(doc_ids)
+        chunk_id_parts.append(chunk_ids)
+
+    if segments:
+        doc_ids = np.concatenate(doc_id_parts)
+        chunk_ids = np.concatenate(chunk_id_parts)
+    else:
+        doc_ids = np.zeros(0, dtype=np.int32)
+        chunk_ids = np.zeros(0, dtype=np.int32)
+
+    docs = [doc["name"] for doc in meta["docs"]]
+    alive = np.array([doc["alive"] for doc in meta["docs"]], dtype=bool)
+    return VectorIndex(folder, segments, doc_ids, chunk_ids, docs, alive, meta["generation"])
+
+
+def _load_block(file: Path, dim: int) -> Optional[np.ndarray]:
+    """读取单篇论文的向量并归一化；非法数据或维度不一致时返回 None"""
+    parsed = read_embedding_file(file)
+    if parsed is None or not parsed[1]:
+        return None
+    block = np.asarray(parsed[1], dtype=np.float32)
+    if dim and block.shape[1] != dim:
+        logger.warning(f"[索引] {file.name} 向量维度 {block.shape[1]} 与索引维度 {dim} 不一致，跳过。")
+        return None
+    return normalize_rows(block)
+
+
+def _compact(index_dir: Path, meta: dict):
+    """
+    合并全部段并丢弃墓碑段落，论文重新编号
+
+    只在已有段之间搬运向量，不重新解析 JSON；结果直接流式写入新段的内存映射文件。
+    """
+    old_docs = meta["docs"]
+    remap = np.full(len(old_docs), -1, dtype=np.int32)
+    new_docs = []
+    for doc_id, doc in enumerate(old_docs):
+        if doc["alive"]:
+            remap[doc_id] = len(new_docs)
+            new_docs.append(doc)
+
+    seg = meta["next_segment"]
+    total = sum(doc["rows"] for doc in new_docs)
+    meta["docs"] = new_docs
+    for entry in meta["manifest"].values():
+        if entry["doc_id"] is not None:
+            entry["doc_id"] = int(remap[entry["doc_id"]])
+    if total == 0:
+        meta["segments"] = []
+        return
+
+    out_vectors = np.lib.format.open_memmap(
+        index_dir / VECTORS_FILE.format(seg=seg), mode="w+", dtype=np.float32, shape=(total, meta["dim"])
+    )
+    doc_id_parts, chunk_id_parts = [], []
+    offset = 0
+    for old_seg in meta["segments"]:
+        vectors, doc_ids, chunk_ids = _load_segment(index_dir, old_seg)
+        keep = remap[doc_ids] >= 0
+        n = int(keep.sum())
+        out_vectors[offset:offset + n] = vectors[keep]
+        doc_id_parts.append(remap[doc_ids][keep])
+        chunk_id_parts.append(np.asarray(chunk_ids)[keep])
+        offset += n
+    out_vectors.flush()
+    del out_vectors
+    np.save(index_dir / DOC_IDS_FILE.format(seg=seg), np.concatenate(doc_id_parts).astype(np.int32))
+    np.save(index_dir / CHUNK_IDS_FILE.format(seg=seg), np.concatenate(chunk_id_parts).astype(np.int32))
+
+    meta["segments"] = [seg]
+    meta["next_segment"] = seg + 1
+    logger.info(f"[索引] 已合并压缩为单段：{len(new_docs)} 篇论文 / {total} 个段落")
+
+
+def _needs_compaction(meta: dict) -> bool:
+    if len(meta["segments"]) > COMPACT_MAX_SEGMENTS:
+        return True
+    total = sum(doc["rows"] for doc in meta["docs"])
+    dead = sum(doc["rows"] for doc in meta["docs"] if not doc["alive"])
+    return total > 0 and dead / total > COMPACT_DEAD_RATIO
+
+
+def update_index(root_dir: Path, rebuild: bool = False) -> dict:
+    """
+    增量更新文献库的向量索引
+
+    对照文件清单逐个检查 <paper>.json：大小与修改时间都未变的文件直接跳过（不读取内容）；
+    变化的文件再比对内容哈希，确有变化才重新读取向量。新增论文追加到新段，变化的论文
+    给旧记录打墓碑后重新追加，已删除的论文只打墓碑。
+
+    参数:
+        root_dir (Path): 文献库目录（包含 <paper>.json）
+        rebuild (bool): 为 True 时忽略已有索引，全量重建
+
+    返回:
+        dict: 本次更新统计 {"added", "replaced", "removed", "unchanged"}
+    """
+    folder = Path(root_dir)
+    index_dir = folder / INDEX_DIRNAME
+    index_dir.mkdir(parents=True, exist_ok=True)
+
+    with index_write_lock(folder):
+        old_meta = _read_meta(index_dir)
+        meta = old_meta
+        if rebuild or meta is None or "manifest" not in meta:
+            # 新建空索引；沿用旧的段编号计数，避免与仍被映射的旧文件重名
+            next_segment = 0
+            if old_meta is not None:
+                next_segment = old_meta.get("next_segment", old_meta.get("generation", -1) + 1)
+            meta = {
+                "generation": old_meta.get("generation", 0) if old_meta else 0,
+                "next_segment": next_segment,
+                "segments": [],
+                "dim": 0,
+                "docs": [],
+                "manifest": {},
+            }
+        manifest = meta["manifest"]
+        stats = {"added": 0, "replaced": 0, "removed": 0, "unchanged": 0}
+        changed = meta is not old_meta
+
+        def tombstone(doc_id):
+            if doc_id is not None:
+                meta["docs"][doc_id]["alive"] = False
+
+        files = {file.name: file for file in folder.glob("*.json")}
+
+        # 1. 已删除的 JSON：只打墓碑
+        for name in [name for name in manifest if name not in files]:
+            tombstone(manifest.pop(name)["doc_id"])
+            stats["removed"] += 1
+            changed = True
+
+        # 2. 新增 / 变化的 JSON：读取向量，准备写入新段
+        new_blocks = []
+        for name in sorted(files):
+            file = files[name]
+            st = file.stat()
+            entry = manifest.get(name)
+            if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+                stats["unchanged"] += 1
+                continue
+
+            digest = _file_sha256(file)
+            changed = True
+            if entry and entry["sha256"] == digest:
+                # 仅修改时间变化（如被重新拷贝），内容未变
+                entry["size"], entry["mtime_ns"] = st.st_size, st.st_mtime_ns
+                stats["unchanged"] += 1
+                continue
+
+            if entry:
+                tombstone(entry["doc_id"])
+                stats["replaced"] += 1
+            else:
+                stats["added"] += 1
+
+            block = _load_block(file, meta["dim"])
+            doc_id = None
+            if block is not None:
+                doc_id = len(meta["docs"])
+                meta["docs"].append({"name": file.stem, "rows": len(block), "alive": True})
+                meta["dim"] = meta["dim"] or int(block.shape[1])
+                new_blocks.append((doc_id, block))
+            manifest[name] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest, "doc_id": doc_id}
+
+        if not changed:
+            return stats
+
+        if new_blocks:
+            seg = meta["next_segment"]
+            _write_segment(
+                index_dir, seg,
+                np.concatenate([block for _, block in new_blocks]),
+                np.concatenate([np.full(len(block), doc_id) for doc_id, block in new_blocks]),
+                np.concatenate([np.arange(len(block)) for _, block in new_blocks]),
+            )
+            meta["segments"].append(seg)
+            meta["next_segment"] = seg + 1
+
+        if meta["segments"] and _needs_compaction(meta):
+            _compact(index_dir, meta)
+
+        meta["generation"] += 1
+        _write_meta(index_dir, meta)
+        _remove_unused_segments(index_dir, meta["segments"])
+
+    logger.info(
+        f"[索引] 更新完成 {folder}：新增 {stats['added']} | 替换 {stats['replaced']} | "
+        f"删除 {stats['removed']} | 未变 {stats['unchanged']}"
+    )
+    return stats
+
+
+def build_index(folder: Path) -> VectorIndex:
+    """
+    全量扫描文献库中的 JSON，重新编译向量索引并写入磁盘
+
+    参数:
+        folder (Path): 文献库目录（包含 <paper>.json）
+
+    返回:
+        VectorIndex: 新建的索引（以内存映射方式加载）
+    """
+    update_index(folder, rebuild=True)
+    return load_index(folder, refresh=False)
+
+
+# 进程内缓存：同一文献库的索引只打开一次，索引代号变化后自动重新打开
+_index_cache = {}
+
+
+def load_index(folder: Path, refresh: bool = False) -> VectorIndex:
+    """
+    获取文献库的向量索引
+
+    默认只读：检索端不写索引，索引由入库流程（update_index / 流式入库的索引线程）维护。
+    只有索引尚不存在时才建立一次。
+
+    参数:
+        folder (Path): 文献库目录
+        refresh (bool): 为 True 时先调用 update_index 同步文献库的增删改（只 stat 未变文件）
+
+    返回:
+        VectorIndex: 可直接用于检索的索引
+    """
+    folder = Path(folder)
+    index_dir = folder / INDEX_DIRNAME
+    if refresh or _read_meta(index_dir) is None:
+        update_index(folder)
+
+    key = str(folder.resolve())
+    for attempt in range(OPEN_RETRIES):
+        meta = _read_meta(index_dir)
+        cached = _index_cache.get(key)
+        if cached is not None and cached[0] == meta["generation"]: # type: ignore
+            return cached[1]
+        try:
+            index = _open_index(folder, meta) # type: ignore
+        except OSError:
+            # 读取 meta 与打开段文件之间，其他进程完成了合并压缩并删除了旧段：meta 已更新则重试
+            latest = _read_meta(index_dir)
+            if attempt == OPEN_RETRIES - 1 or latest is None or latest["generation"] == meta["generation"]: # type: ignore
+                raise
+            time.sleep(OPEN_RETRY_DELAY)
+            continue
+        _index_cache[key] = (meta["generation"], index) # type: ignore
+        return index
+
+
+if __name__ == "__main__":
+    update_index(Path("embedding_qwen_long"))
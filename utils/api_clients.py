@@ -0,0 +1,145 @@
+# utils/api_clients.py
+"""
+共享的模型服务客户端
+
+pipeline/ 与 research_pipeline/ 中所有对通义、DeepSeek、硅基流动的调用都从这里取客户端：
+    - get_openai_client(provider)：OpenAI 兼容客户端，按 (base_url, api_key) 缓存复用；
+    - create_async_openai_client(provider)：异步客户端，每个事件循环一个；
+    - get_http_session(provider)：requests 会话，按 base_url 缓存复用（硅基流动 embedding、本地向量服务等裸 HTTP 调用）。
+客户端内部维护 keep-alive 连接池，多线程（ThreadPoolExecutor）共用同一实例是安全的，
+不必每次调用都重新建立 TCP + TLS 连接。每个服务商的连接池大小单独限制（max_connections），
+并发线程数超过上限时在连接池处排队等待，而不是对服务商无限制地开新连接。
+"""
+
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 服务商配置：接口地址、API Key 环境变量、连接池上限
+PROVIDERS = {
+    "qwen": {
+        "base_url": "https://dashscope.aliyuncs.com/compatible-mode/v1",
+        "api_key_env": "QWEN_API_KEY",
+        "max_connections": 16,
+    },
+    "deepseek": {
+        "base_url": "https://api.deepseek.com/v1",
+        "api_key_env": "DEEPSEEK_API_KEY",
+        "max_connections": 8,
+    },
+    "siliconflow": {
+        "base_url": "https://api.siliconflow.cn/v1",
+        "api_key_env": "SOLID_API_KEY",
+        "max_connections": 16,
+    },
+    "embedding_server": {  # 本地 BGE-M3 共享向量服务（pipeline/embedding_server.py），默认不设 API Key
+        "base_url": os.getenv("EMBEDDING_SERVER_URL", "http://127.0.0.1:8765"),
+        "api_key_env": "EMBEDDING_SERVER_API_KEY",
+        "max_connections": 32,
+    },
+}
+CLIENT_TIMEOUT = 600  # OpenAI 兼容客户端的请求超时（秒），qwen-long 长文档总结耗时较长
+
+_openai_clients = {}  # (base_url, api_key) → OpenAI
+_sessions = {}        # base_url → requests.Session
+_lock = threading.Lock()
+
+
+def get_api_key(provider: str) -> str:
+    """读取服务商的 API Key（环境变量或 .env）"""
+    return os.getenv(PROVIDERS[provider]["api_key_env"], "")
+
+
+def get_openai_client(provider: str, api_key: str = None): # type: ignore
+    """
+    获取服务商的共享 OpenAI 兼容客户端
+
+    参数:
+        provider (str): 服务商名称，见 PROVIDERS（"qwen" / "deepseek" / "siliconflow"）
+        api_key (str): 可选，显式指定 API Key；默认读取 PROVIDERS 中配置的环境变量
+
+    返回:
+        OpenAI: 线程安全、连接复用的客户端实例
+    """
+    cfg = PROVIDERS[provider]
+    api_key = api_key or get_api_key(provider)
+    key = (cfg["base_url"], api_key)
+    client = _openai_clients.get(key)
+    if client is None:
+        with _lock:
+            client = _openai_clients.get(key)
+            if client is None:
+                import httpx
+                from openai import OpenAI
+
+                limit = cfg["max_connections"]
+                http_client = httpx.Client(
+                    limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit),
+                    timeout=CLIENT_TIMEOUT,
+                )
+                # 重试由 utils/rate_limit.call_with_retry 统一负责，关闭 SDK 自带重试以免叠加
+                client = OpenAI(api_key=api_key, base_url=cfg["base_url"], http_client=http_client, max_retries=0)
+                _openai_clients[key] = client
+    return client
+
+
+def create_async_openai_client(provider: str, api_key: str = None): # type: ignore
+    """
+    创建服务商的 AsyncOpenAI 客户端（异步流水线使用）
+
+    异步连接池绑定在创建它的事件循环上，因此不做全局缓存：每个事件循环创建一个，
+    用完后 await client.close()。连接池上限与同步客户端相同。
+
+    参数:
+        provider (str): 服务商名称，见 PROVIDERS
+        api_key (str): 可选，显式指定 API Key
+
+    返回:
+        AsyncOpenAI: 异步客户端实例
+    """
+    import httpx
+    from openai import AsyncOpenAI
+
+    cfg = PROVIDERS[provider]
+    limit = cfg["max_connections"]
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit),
+        timeout=CLIENT_TIMEOUT,
+    )
+    return AsyncOpenAI(api_key=api_key or get_api_key(provider), base_url=cfg["base_url"],
+                       http_client=http_client, max_retries=0)
+
+
+def get_http_session(provider: str) -> requests.Session:
+    """
+    获取服务商的共享 requests 会话
+
+    会话挂载的连接池大小为该服务商的 max_connections，连接用尽时阻塞等待（pool_block），
+    配置了 API Key 时请求头已带上 Authorization。
+
+    参数:
+        provider (str): 服务商名称，见 PROVIDERS
+
+    返回:
+        requests.Session: 连接复用的会话，请求地址为 PROVIDERS[provider]["base_url"] + 路径
+    """
+    cfg = PROVIDERS[provider]
+    session = _sessions.get(cfg["base_url"])
+    if session is None:
+        with _lock:
+            session = _sessions.get(cfg["base_url"])
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=cfg["max_connections"], pool_block=True)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({"Content-Type": "application/json"})
+                api_key = get_api_key(provider)
+                if api_key:
+                    session.headers.update({"Authorization": f"Bearer {api_key}"})
+                _sessions[cfg["base_url"]] = session
+    return session
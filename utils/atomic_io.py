@@ -0,0 +1,32 @@
+# utils/atomic_io.py
+"""
+原子写文件：先写同目录下的临时文件，再 os.replace 替换目标
+
+进程在写入中途崩溃时只会留下 .tmp 临时文件，目标文件要么是旧内容、要么是完整的新内容，
+不会出现被"已存在即跳过"逻辑永久跳过的截断文件。
+"""
+
+import os
+import json
+import threading
+from pathlib import Path
+
+
+def atomic_write_text(path: Path, text: str, encoding: str = "utf-8"):
+    """原子写入文本文件"""
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, "w", encoding=encoding) as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def atomic_write_json(path: Path, data, **dump_kwargs):
+    """原子写入 JSON 文件，dump_kwargs 透传给 json.dumps（如 ensure_ascii / indent）"""
+    atomic_write_text(path, json.dumps(data, **dump_kwargs))
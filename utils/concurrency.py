@@ -0,0 +1,214 @@
+# utils/concurrency.py
+"""
+自适应并发控制（AIMD）
+
+网络请求类任务的合适并发数取决于服务商当前配额与响应速度，而不是本机 CPU 核数。
+AdaptiveLimiter 按"加性增、乘性减"调节在途请求上限：
+    - 每完成 WINDOW 个请求评估一次：没有限流且错误率正常时上限 +1；
+    - 出现限流（429，由 utils/rate_limit 上报）、错误率超过 MAX_ERROR_RATE，
+      或某类任务的 p95 延迟超过其基线的 LATENCY_TOLERANCE 倍时上限减半。
+同一服务商的 limiter 被长文档总结、短文本向量化等耗时相差数十倍的任务共用，
+因此延迟基线按任务类型（workload，通常为调用点）分别维护：基线是该类任务各窗口 p95 的指数滑动平均，
+每类任务攒满 LATENCY_SAMPLES 个样本才评估一次；总结类任务的耗时随输入长短变化，基线会随之回升，
+一批短文档不会把基线永久压低。
+同一服务商的所有执行器共用一个 limiter（get_limiter），上限在多个阶段之间共享；
+初始上限可由首个创建它的调用方按负载指定（initial）。任务须以抛出异常表示失败，limiter 才能看到错误。
+
+用法:
+    with AdaptiveExecutor("qwen", initial=10, workload="pdf_summary") as executor:
+        futures = [executor.submit(fn, arg) for arg in args]
+        for future in as_completed(futures):
+            ...
+"""
+
+import time
+import threading
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+
+from log_init import setup_logger
+
+logger = setup_logger(__name__)  # 初始化log信息
+
+INITIAL_LIMIT = 4         # 初始在途请求上限
+MIN_LIMIT = 1
+MAX_LIMIT = 32            # 上限的上界，同时也是执行器的线程数
+WINDOW = 8                # 每完成多少个请求评估一次
+MAX_ERROR_RATE = 0.2      # 窗口内错误率超过该值时减半
+DECREASE_FACTOR = 0.5     # 乘性减的系数
+THROTTLE_COOLDOWN = 5.0   # 减半后该时间内（秒）的限流上报不再重复减半（在途请求的 429 属于同一次过载）
+LATENCY_SAMPLES = 8       # 每类任务攒满多少个延迟样本评估一次 p95
+LATENCY_TOLERANCE = 2.0   # p95 超过基线的该倍数时视为过载
+BASELINE_ALPHA = 0.2      # 延迟基线（EWMA）中最新窗口 p95 的权重
+
+
+class AdaptiveLimiter:
+    """
+    AIMD 在途请求上限控制器（线程安全）
+
+    参数:
+        name (str): 名称，仅用于日志
+        initial (int): 初始上限
+        min_limit (int): 上限的下界
+        max_limit (int): 上限的上界
+    """
+
+    def __init__(self, name: str, initial: int = INITIAL_LIMIT, min_limit: int = MIN_LIMIT, max_limit: int = MAX_LIMIT):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = max(min_limit, min(initial, max_limit))
+        self.in_flight = 0
+        self._completed = 0
+        self._errors = 0
+        self._throttled = False
+        self._last_decrease = 0.0
+        self._latencies = {}   # workload → 当前窗口的延迟样本
+        self._baselines = {}   # workload → 延迟基线（各窗口 p95 的 EWMA）
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """在途请求数达到上限时阻塞等待"""
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, started: float, ok: bool = True, workload: str = "default"):
+        """
+        记录一个请求的结果并释放名额
+
+        参数:
+            started (float): 请求开始时刻（time.monotonic()）
+            ok (bool): 是否成功
+            workload (str): 任务类型，延迟基线按此分别维护；失败请求的延迟不计入
+        """
+        with self._cond:
+            self.in_flight -= 1
+            # 上次减半之前发出的请求反映的是减半前的负载，不计入新窗口
+            if started >= self._last_decrease:
+                self._completed += 1
+                self._errors += 0 if ok else 1
+                if ok:
+                    self._latencies.setdefault(workload, []).append(time.monotonic() - started)
+                if self._completed >= WINDOW:
+                    self._evaluate()
+            self._cond.notify_all()
+
+    def record_throttle(self):
+        """服务商返回限流时调用：立即减半，并作废当前窗口"""
+        with self._cond:
+            if time.monotonic() - self._last_decrease < THROTTLE_COOLDOWN:
+                return
+            self._throttled = True
+            self._evaluate()
+
+    def _slow_workload(self) -> Optional[str]:
+        """
+        在 _cond 内调用：检查样本已攒满的任务类型，返回 p95 超过基线容忍倍数的任务类型（没有则为 None）
+
+        基线为各窗口 p95 的 EWMA（首个窗口即为初始基线）；判定为过载的窗口同样计入，
+        持续变长的正常负载会让基线逐步回升，上限不会因此一路减到下界。评估过的样本清空。
+        """
+        slow = None
+        for workload, samples in self._latencies.items():
+            if len(samples) < LATENCY_SAMPLES:
+                continue
+            p95 = sorted(samples)[min(len(samples) - 1, int(len(samples) * 0.95))]
+            baseline = self._baselines.get(workload)
+            if baseline is not None and p95 > LATENCY_TOLERANCE * baseline:
+                slow = slow or workload
+            self._baselines[workload] = p95 if baseline is None else \
+                (1 - BASELINE_ALPHA) * baseline + BASELINE_ALPHA * p95
+            samples.clear()
+        return slow
+
+    def _evaluate(self):
+        """在 _cond 内调用：根据当前窗口调整上限"""
+        old = self.limit
+        error_rate = self._errors / self._completed if self._completed else 0.0
+        slow = self._slow_workload()
+
+        if self._throttled or error_rate > MAX_ERROR_RATE or slow is not None:
+            self.limit = max(self.min_limit, int(self.limit * DECREASE_FACTOR))
+            if self._throttled:
+                reason = "限流"
+            elif error_rate > MAX_ERROR_RATE:
+                reason = "错误率升高"
+            else:
+                reason = f"{slow} 延迟升高"
+        else:
+            self.limit = min(self.max_limit, self.limit + 1)
+            reason = None
+
+        if self.limit < old:
+            self._last_decrease = time.monotonic()
+            for samples in self._latencies.values():
+                samples.clear()  # 减半前的样本反映的是旧负载
+            logger.warning(f"[并发] {self.name} {reason}，上限 {old} → {self.limit}")
+        self._completed = 0
+        self._errors = 0
+        self._throttled = False
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str, initial: int = None) -> AdaptiveLimiter: # type: ignore
+    """
+    获取按名称（通常为服务商名）共享的 AdaptiveLimiter
+
+    参数:
+        name (str): limiter 名称
+        initial (int): 可选，首次创建时的初始上限，默认 INITIAL_LIMIT；
+                       limiter 已存在时沿用其已调节到的上限，忽略该参数
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = AdaptiveLimiter(name, initial or INITIAL_LIMIT)
+        return _limiters[name]
+
+
+class AdaptiveExecutor:
+    """
+    通过 AdaptiveLimiter 调度任务的线程池
+
+    线程数固定为 limiter 的上界，实际同时执行的任务数由 limiter 当前上限决定；
+    submit 返回标准 Future，可直接配合 as_completed 使用。
+
+    参数:
+        name (str): limiter 名称（服务商名），同名执行器共享上限
+        max_workers (int): 可选，线程数上界，默认 MAX_LIMIT
+        initial (int): 可选，limiter 首次创建时的初始上限（见 get_limiter）
+        workload (str): 可选，任务类型（通常为调用点），同名 limiter 下按此分别维护延迟基线，默认与 name 相同
+    """
+
+    def __init__(self, name: str, max_workers: int = None, initial: int = None, workload: str = None): # type: ignore
+        self.limiter = get_limiter(name, initial)
+        self.workload = workload or name
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or self.limiter.max_limit)
+
+    def submit(self, fn, *args, **kwargs):
+        return self._pool.submit(self._run, fn, *args, **kwargs)
+
+    def _run(self, fn, *args, **kwargs):
+        self.limiter.acquire()
+        started = time.monotonic()
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            self.limiter.release(started, ok, self.workload)
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown(wait=True)
+        return False
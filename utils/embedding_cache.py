@@ -0,0 +1,109 @@
+# utils/embedding_cache.py
+"""
+段落级向量缓存（SQLite）
+
+按 (模型标识, 段落文本的 SHA-256) 保存向量（float64 二进制，与接口返回值逐位一致，
+由缓存拼出的 .json 与重新请求得到的完全相同）。summary.md 重新生成后，
+只有内容变化的"技术要点"段落需要重新请求向量，其余段落直接取缓存拼出新的 .json；
+不同论文中完全相同的段落（模板化内容）也只向量化一次。
+
+表结构:
+    chunk_embeddings(model, sha256, dim, vector, created_at)
+    主键 (model, sha256)
+"""
+
+import time
+import hashlib
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from log_init import setup_logger
+from utils.sqlite_store import open_db
+
+logger = setup_logger(__name__)  # 初始化log信息
+
+CACHE_PATH = Path(".cache") / "chunk_embeddings.sqlite3"
+LOOKUP_BATCH = 500  # 单条 SQL 查询的最大键数（SQLite 参数个数有上限）
+VECTOR_DTYPE = np.float64  # 写入的向量类型；早期以 float32 写入的条目按 BLOB 长度识别后照常读取
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunk_embeddings (
+    model TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    dim INTEGER NOT NULL,
+    vector BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (model, sha256)
+);
+"""
+
+
+def _connect():
+    return open_db(CACHE_PATH, _SCHEMA)
+
+
+def chunk_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _decode(blob: bytes, dim: int) -> list:
+    dtype = np.float32 if len(blob) == dim * 4 else VECTOR_DTYPE
+    return np.frombuffer(blob, dtype=dtype).tolist()
+
+
+def lookup_many(model_id: str, texts: List[str]) -> List[Optional[list]]:
+    """
+    批量查询段落向量
+
+    返回:
+        与 texts 等长的列表，命中为向量（list[float]），未命中为 None
+    """
+    hashes = [chunk_sha256(t) for t in texts]
+    found = {}
+    unique = list(set(hashes))
+    with _connect() as conn:
+        for i in range(0, len(unique), LOOKUP_BATCH):
+            part = unique[i:i + LOOKUP_BATCH]
+            rows = conn.execute(
+                f"SELECT sha256, dim, vector FROM chunk_embeddings WHERE model = ? AND sha256 IN ({','.join('?' * len(part))})",
+                (model_id, *part)).fetchall()
+            found.update({sha: _decode(blob, dim) for sha, dim, blob in rows})
+    return [found.get(h) for h in hashes]
+
+
+def store_many(model_id: str, texts: List[str], vectors: List[list]):
+    """保存段落向量（已存在的覆盖）"""
+    now = time.time()
+    rows = []
+    for text, vec in zip(texts, vectors):
+        arr = np.asarray(vec, dtype=VECTOR_DTYPE)
+        rows.append((model_id, chunk_sha256(text), arr.shape[0], arr.tobytes(), now))
+    with _connect() as conn:
+        conn.executemany("INSERT OR REPLACE INTO chunk_embeddings VALUES (?, ?, ?, ?, ?)", rows)
+
+
+def embed_with_cache(texts: List[str], model_id: str, embed_fn: Callable[[List[str]], list]) -> list:
+    """
+    读穿缓存的批量向量化：命中的段落直接取缓存，未命中的去重后一次交给 embed_fn，结果写回缓存
+
+    参数:
+        texts (list): 段落文本
+        model_id (str): 模型标识（不同模型 / 推理精度的向量不可混用）
+        embed_fn (callable): 接收文本列表、返回等长向量列表的函数
+
+    返回:
+        list: 与 texts 一一对应的向量列表
+    """
+    vectors = lookup_many(model_id, texts)
+    missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))  # 去重并保持顺序
+    if missing:
+        new_vectors = embed_fn(missing)
+        if len(new_vectors) != len(missing):
+            raise RuntimeError(f"向量化返回 {len(new_vectors)} 条向量，期望 {len(missing)} 条")
+        store_many(model_id, missing, new_vectors)
+        by_text = dict(zip(missing, new_vectors))
+        vectors = [v if v is not None else by_text[t] for t, v in zip(texts, vectors)]
+    logger.debug(f"[向量缓存] {model_id}：{len(texts)} 段，新向量化 {len(missing)} 段")
+    return vectors
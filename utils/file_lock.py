@@ -0,0 +1,63 @@
+# utils/file_lock.py
+"""
+跨进程文件锁
+
+Streamlit、入库流程与临时脚本是互相独立的进程，进程内的 threading.Lock 无法让它们互斥。
+file_lock 在锁文件上加操作系统级的排他锁（POSIX 用 fcntl.flock，Windows 用 msvcrt.locking），
+进程退出（包括崩溃）时锁由系统自动释放，不会留下需要手工删除的死锁。
+
+用法:
+    with file_lock(index_dir / ".lock"):
+        ...  # 读 meta → 写新段 → 切换 meta → 清理旧段
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+WINDOWS_POLL_INTERVAL = 0.05  # Windows 下加锁失败后的重试间隔（秒），msvcrt 的阻塞模式最多只等 10 秒
+
+if os.name == "nt":
+    import msvcrt
+
+    def _acquire(fd: int):
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                time.sleep(WINDOWS_POLL_INTERVAL)
+
+    def _release(fd: int):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _acquire(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _release(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+@contextmanager
+def file_lock(path: Path):
+    """
+    持有锁文件上的排他锁直到 with 块结束（阻塞等待其他进程释放）
+
+    参数:
+        path (Path): 锁文件路径，不存在时自动创建；文件内容无意义，用完也不删除
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        _acquire(fd)
+        try:
+            yield
+        finally:
+            _release(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,153 @@
+# utils/file_registry.py
+"""
+已上传文件登记表（SQLite）
+
+同一篇 PDF 在入库（summarize_with_qwen_long）和每次调研（research_long_analyse）时都会用到，
+按文件内容的 SHA-256 记录上传到服务商后得到的 file_id、解析状态与过期时间：
+命中且未过期、远端仍存在时直接复用 file_id，已解析完成的还可跳过解析等待；未命中或失效时才重新上传。
+
+表结构:
+    uploaded_files(sha256, provider, file_id, filename, status, uploaded_at, expires_at)
+    主键 (sha256, provider)
+"""
+
+import time
+import asyncio
+import hashlib
+from pathlib import Path
+from typing import Optional, Tuple
+
+from log_init import setup_logger
+from utils.rate_limit import call_with_retry, acall_with_retry
+from utils.sqlite_store import open_db
+
+logger = setup_logger(__name__)  # 初始化log信息
+
+REGISTRY_PATH = Path(".cache") / "file_registry.sqlite3"
+FILE_TTL = 30 * 24 * 3600  # file_id 的有效期（秒），超过后重新上传
+STATUS_UPLOADED = "uploaded"    # 已上传，尚未确认解析完成
+STATUS_PROCESSED = "processed"  # 服务端已解析完成，可直接用于对话
+
+
+def file_sha256(path: Path) -> str:
+    """按 1MB 分块计算文件的 SHA-256"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploaded_files (
+    sha256 TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    filename TEXT,
+    status TEXT NOT NULL,
+    uploaded_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (sha256, provider)
+);
+"""
+
+
+def _connect():
+    return open_db(REGISTRY_PATH, _SCHEMA)
+
+
+def lookup(sha256: str, provider: str = "qwen") -> Optional[Tuple[str, str]]:
+    """
+    查询未过期的登记记录
+
+    返回:
+        (file_id, status)；没有记录或已过期时返回 None
+    """
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT file_id, status FROM uploaded_files WHERE sha256 = ? AND provider = ? AND expires_at > ?",
+            (sha256, provider, time.time()),
+        ).fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def record(sha256: str, file_id: str, filename: str = "", provider: str = "qwen", status: str = STATUS_UPLOADED):
+    """登记一次上传（覆盖同一文件的旧记录）"""
+    now = time.time()
+    with _connect() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO uploaded_files VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (sha256, provider, file_id, filename, status, now, now + FILE_TTL),
+        )
+
+
+def mark_processed(file_id: str, provider: str = "qwen"):
+    """解析完成后更新状态，之后复用时可跳过解析等待"""
+    with _connect() as conn:
+        conn.execute("UPDATE uploaded_files SET status = ? WHERE file_id = ? AND provider = ?",
+                     (STATUS_PROCESSED, file_id, provider))
+
+
+def invalidate(file_id: str, provider: str = "qwen"):
+    """远端文件已失效（被删除 / 过期）时移除记录"""
+    with _connect() as conn:
+        conn.execute("DELETE FROM uploaded_files WHERE file_id = ? AND provider = ?", (file_id, provider))
+
+
+def get_or_upload(client, pdf_path: Path, provider: str = "qwen") -> Tuple[str, bool]:
+    """
+    复用已登记的 file_id，未命中或远端已失效时上传并登记
+
+    参数:
+        client: OpenAI 兼容客户端（get_openai_client 获得）
+        pdf_path (Path): 待上传的 PDF
+        provider (str): 服务商名称
+
+    返回:
+        (file_id, ready)：ready 为 True 表示远端已解析完成，可跳过解析等待
+    """
+    sha = file_sha256(pdf_path)
+    hit = lookup(sha, provider)
+    if hit is not None:
+        file_id, status = hit
+        try:
+            remote = call_with_retry(provider, client.files.retrieve, file_id)
+            remote_status = getattr(remote, "status", "")
+            if remote_status != "error":
+                logger.info(f"[复用] {pdf_path.name} → file-id: {file_id}")
+                return file_id, remote_status == STATUS_PROCESSED or status == STATUS_PROCESSED
+        except Exception as e:
+            logger.warning(f"[登记表] {pdf_path.name} 的 file-id {file_id} 已失效，重新上传：{e}")
+        invalidate(file_id, provider)
+
+    file_object = call_with_retry(provider, client.files.create, file=pdf_path, purpose="file-extract")
+    record(sha, file_object.id, pdf_path.name, provider)
+    return file_object.id, False
+
+
+async def aget_or_upload(aclient, pdf_path: Path, provider: str = "qwen", upload_sem=None) -> Tuple[str, bool]:
+    """
+    get_or_upload 的协程版本；upload_sem 只在真正上传时占用（查询登记表与远端状态不占名额）。
+    计算文件哈希与读写登记表均在线程中执行，不阻塞事件循环。
+    """
+    sha = await asyncio.to_thread(file_sha256, pdf_path)
+    hit = await asyncio.to_thread(lookup, sha, provider)
+    if hit is not None:
+        file_id, status = hit
+        try:
+            remote = await acall_with_retry(provider, aclient.files.retrieve, file_id)
+            remote_status = getattr(remote, "status", "")
+            if remote_status != "error":
+                logger.info(f"[复用] {pdf_path.name} → file-id: {file_id}")
+                return file_id, remote_status == STATUS_PROCESSED or status == STATUS_PROCESSED
+        except Exception as e:
+            logger.warning(f"[登记表] {pdf_path.name} 的 file-id {file_id} 已失效，重新上传：{e}")
+        await asyncio.to_thread(invalidate, file_id, provider)
+
+    if upload_sem is None:
+        file_object = await acall_with_retry(provider, aclient.files.create, file=pdf_path, purpose="file-extract")
+    else:
+        async with upload_sem:
+            file_object = await acall_with_retry(provider, aclient.files.create, file=pdf_path, purpose="file-extract")
+    await asyncio.to_thread(record, sha, file_object.id, pdf_path.name, provider)
+    return file_object.id, False
@@ -0,0 +1,171 @@
+# utils/job_ledger.py
+"""
+入库任务台账（SQLite）
+
+记录每篇 PDF 在 上传 → 解析 → 总结 → 向量化 → 索引 各阶段的状态、尝试次数、耗时与错误信息，
+取代"输出文件存在即视为完成"的判断：中途崩溃或失败的阶段在台账中为 running / failed，
+下次运行时只重做这些未完成的工作。
+
+用法:
+    with track(name, STAGE_SUMMARIZE):
+        ...  # 抛出异常时记为 failed 并原样抛出
+
+    async with atrack(name, STAGE_SUMMARIZE):   # 协程中使用：台账读写放到线程中执行，不阻塞事件循环
+        ...
+
+    python -m utils.job_ledger   # 打印各阶段吞吐统计与失败列表
+"""
+
+import time
+import asyncio
+from pathlib import Path
+from contextlib import asynccontextmanager, contextmanager
+from typing import List, Optional
+
+from utils.sqlite_store import open_db
+
+LEDGER_PATH = Path(".cache") / "ingest_ledger.sqlite3"
+
+# 台账以 (论文名, 阶段) 为键：输出到不同目录的流程须使用不同的阶段名，否则同名论文的记录互相覆盖
+STAGE_UPLOAD = "upload"
+STAGE_PARSE = "parse"
+STAGE_SUMMARIZE = "summarize"         # 通义 qwen-long 直接总结 PDF（输出到 embedding_qwen_long）
+STAGE_SUMMARIZE_MD = "summarize_md"   # DeepSeek 总结 OCR 得到的 Markdown（输出到 embedding_out）
+STAGE_EMBED = "embed"
+STAGE_INDEX = "index"
+STAGES = [STAGE_UPLOAD, STAGE_PARSE, STAGE_SUMMARIZE, STAGE_SUMMARIZE_MD, STAGE_EMBED, STAGE_INDEX]
+
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_stages (
+    name TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    started_at REAL,
+    finished_at REAL,
+    duration REAL,
+    PRIMARY KEY (name, stage)
+);
+CREATE INDEX IF NOT EXISTS idx_job_stages_status ON job_stages (stage, status);
+"""
+
+
+def _connect():
+    return open_db(LEDGER_PATH, _SCHEMA)
+
+
+def start(name: str, stage: str) -> float:
+    """记录阶段开始（尝试次数 +1），返回开始时刻"""
+    now = time.time()
+    with _connect() as conn:
+        conn.execute("""
+            INSERT INTO job_stages (name, stage, status, attempts, started_at) VALUES (?, ?, ?, 1, ?)
+            ON CONFLICT (name, stage) DO UPDATE SET
+                status = excluded.status, attempts = attempts + 1, error = NULL,
+                started_at = excluded.started_at, finished_at = NULL, duration = NULL
+            """, (name, stage, STATUS_RUNNING, now))
+    return now
+
+
+def finish(name: str, stage: str, started_at: float, error: Optional[str] = None):
+    """记录阶段结束：error 为空时记为 done，否则记为 failed 并保存错误信息"""
+    now = time.time()
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE job_stages SET status = ?, error = ?, finished_at = ?, duration = ? WHERE name = ? AND stage = ?",
+            (STATUS_FAILED if error else STATUS_DONE, error, now, now - started_at, name, stage),
+        )
+
+
+@contextmanager
+def track(name: str, stage: str):
+    """记录一个阶段的执行：正常结束记为 done，抛出异常记为 failed（异常原样抛出）"""
+    started_at = start(name, stage)
+    try:
+        yield
+    except BaseException as e:
+        finish(name, stage, started_at, f"{type(e).__name__}: {e}")
+        raise
+    finish(name, stage, started_at)
+
+
+@asynccontextmanager
+async def atrack(name: str, stage: str):
+    """track 的协程版本：SQLite 读写在线程中执行"""
+    started_at = await asyncio.to_thread(start, name, stage)
+    try:
+        yield
+    except BaseException as e:
+        await asyncio.to_thread(finish, name, stage, started_at, f"{type(e).__name__}: {e}")
+        raise
+    await asyncio.to_thread(finish, name, stage, started_at)
+
+
+def stage_status(name: str, stage: str) -> Optional[str]:
+    """返回某篇论文某阶段的状态；台账中没有记录时返回 None"""
+    with _connect() as conn:
+        row = conn.execute("SELECT status FROM job_stages WHERE name = ? AND stage = ?", (name, stage)).fetchone()
+    return row[0] if row else None
+
+
+def unfinished(stage: str) -> List[str]:
+    """返回该阶段处于 running（上次中断）或 failed 的论文名"""
+    with _connect() as conn:
+        rows = conn.execute("SELECT name FROM job_stages WHERE stage = ? AND status != ?", (stage, STATUS_DONE)).fetchall()
+    return [row[0] for row in rows]
+
+
+def stats() -> dict:
+    """
+    各阶段吞吐统计
+
+    返回:
+        dict: 阶段 → {"done", "failed", "running", "attempts", "avg_s", "p50_s", "per_hour"}；
+              per_hour 为按完成时间跨度计算的每小时完成数
+    """
+    result = {}
+    with _connect() as conn:
+        for stage in STAGES:
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM job_stages WHERE stage = ? GROUP BY status", (stage,)).fetchall())
+            durations = [row[0] for row in conn.execute(
+                "SELECT duration FROM job_stages WHERE stage = ? AND status = ? ORDER BY duration", (stage, STATUS_DONE))]
+            span = conn.execute(
+                "SELECT MIN(started_at), MAX(finished_at), SUM(attempts) FROM job_stages WHERE stage = ?", (stage,)).fetchone()
+            done = counts.get(STATUS_DONE, 0)
+            hours = (span[1] - span[0]) / 3600 if span[0] and span[1] and span[1] > span[0] else 0
+            result[stage] = {
+                "done": done,
+                "failed": counts.get(STATUS_FAILED, 0),
+                "running": counts.get(STATUS_RUNNING, 0),
+                "attempts": span[2] or 0,
+                "avg_s": sum(durations) / len(durations) if durations else 0.0,
+                "p50_s": durations[len(durations) // 2] if durations else 0.0,
+                "per_hour": done / hours if hours else 0.0,
+            }
+    return result
+
+
+def failures(limit: int = 50) -> List[tuple]:
+    """最近的失败记录：[(论文名, 阶段, 尝试次数, 错误信息)]"""
+    with _connect() as conn:
+        return conn.execute(
+            "SELECT name, stage, attempts, error FROM job_stages WHERE status = ? ORDER BY finished_at DESC LIMIT ?",
+            (STATUS_FAILED, limit)).fetchall()
+
+
+if __name__ == "__main__":
+    print("\n📊 入库台账统计\n")
+    for stage, s in stats().items():
+        print(f"- {stage:<12}: 完成 {s['done']} | 失败 {s['failed']} | 进行中/中断 {s['running']} | 尝试 {s['attempts']} 次 | "
+              f"平均 {s['avg_s']:.1f}s | p50 {s['p50_s']:.1f}s | {s['per_hour']:.1f} 篇/小时")
+    rows = failures()
+    if rows:
+        print("\n❌ 失败记录\n")
+        for name, stage, attempts, error in rows:
+            print(f"- [{stage}] {name}（{attempts} 次）：{error}")
@@ -0,0 +1,83 @@
+# utils/ocr_cache.py
+"""
+逐页 OCR 结果缓存（SQLite）
+
+按 (PDF 内容 SHA-256, 页序号, DPI, OCR 配置) 保存 PPStructure 的原始版面识别结果（去掉区域截图）。
+调整 Markdown 后处理（标题识别、表格转换、页眉页脚过滤等）后重新生成时，命中的页无需再栅格化和 OCR，
+重新生成只剩纯后处理。
+
+表结构:
+    ocr_pages(pdf_sha256, page, dpi, config, results, created_at)
+    主键 (pdf_sha256, page, dpi, config)
+"""
+
+import json
+import time
+import hashlib
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from utils.sqlite_store import open_db
+
+CACHE_PATH = Path(".cache") / "ocr_pages.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_pages (
+    pdf_sha256 TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    dpi INTEGER NOT NULL,
+    config TEXT NOT NULL,
+    results TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (pdf_sha256, page, dpi, config)
+);
+"""
+
+
+def _connect():
+    return open_db(CACHE_PATH, _SCHEMA)
+
+
+def config_key(engine_kwargs: dict) -> str:
+    """OCR 配置的键：只包含影响识别结果的参数（线程数等不影响结果的参数不计入）"""
+    relevant = {k: v for k, v in engine_kwargs.items() if k != "cpu_threads"}
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def to_serializable(results):
+    """将 PPStructure 结果转换为可 JSON 序列化的结构：去掉区域截图 img，numpy 数组 / 标量转为 Python 类型"""
+    if isinstance(results, dict):
+        return {k: to_serializable(v) for k, v in results.items() if k != "img"}
+    if isinstance(results, (list, tuple)):
+        return [to_serializable(v) for v in results]
+    if isinstance(results, np.ndarray):
+        return results.tolist()
+    if isinstance(results, np.generic):
+        return results.item()
+    return results
+
+
+def lookup(pdf_sha256: str, pages: List[int], dpi: int, config: str) -> Dict[int, list]:
+    """
+    查询多页的缓存结果
+
+    返回:
+        dict: 页序号 → OCR 结果（仅包含命中的页）
+    """
+    if not pages:
+        return {}
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT page, results FROM ocr_pages WHERE pdf_sha256 = ? AND dpi = ? AND config = ?",
+            (pdf_sha256, dpi, config)).fetchall()
+    wanted = set(pages)
+    return {page: json.loads(results) for page, results in rows if page in wanted}
+
+
+def store(pdf_sha256: str, page: int, dpi: int, config: str, results: list):
+    """保存一页的 OCR 结果（results 须已经过 to_serializable）"""
+    with _connect() as conn:
+        conn.execute("INSERT OR REPLACE INTO ocr_pages VALUES (?, ?, ?, ?, ?, ?)",
+                     (pdf_sha256, page, dpi, config, json.dumps(results, ensure_ascii=False), time.time()))
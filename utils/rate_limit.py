@@ -0,0 +1,207 @@
+# utils/rate_limit.py
+"""
+模型服务调用的限流与重试
+
+    - 每个服务商两个令牌桶：每分钟请求数（rpm）与每分钟 token 数（tpm），发请求前先取令牌，
+      令牌不足时阻塞等待，使大批量任务稳定运行在配额上限附近，而不是突发后集体 429；
+    - 429 / 5xx / 连接错误 / 超时按带抖动的指数退避重试，服务端返回 Retry-After 时以其为准；
+    - 重试用尽后抛出 RetryExhaustedError，由调用方按失败处理（不再返回空结果）。
+
+用法:
+    result = call_with_retry("qwen", client.embeddings.create, input=texts, model="text-embedding-v3",
+                             tokens=estimate_tokens(texts))
+"""
+
+import time
+import random
+import asyncio
+import threading
+import requests
+
+from log_init import setup_logger
+from utils.concurrency import get_limiter
+
+logger = setup_logger(__name__)  # 初始化log信息
+
+# 各服务商配额（按账号实际档位调整）
+RATE_LIMITS = {
+    "qwen": {"rpm": 1200, "tpm": 1_000_000},
+    "deepseek": {"rpm": 600, "tpm": 1_000_000},
+    "siliconflow": {"rpm": 2000, "tpm": 500_000},
+}
+MAX_RETRIES = 5          # 首次请求之后的最大重试次数
+BACKOFF_BASE = 1.0       # 退避基数（秒），第 n 次重试等待 BACKOFF_BASE * 2^n 内的随机时长
+BACKOFF_MAX = 60.0       # 单次退避上限（秒）
+TOKENS_PER_CHAR = 0.7    # 估算 token 数用：中文约 0.6~1 token / 字
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class RetryExhaustedError(Exception):
+    """重试次数用尽仍未成功"""
+
+    def __init__(self, provider: str, attempts: int, last_error: Exception):
+        self.provider = provider
+        self.attempts = attempts
+        self.last_error = last_error
+        super().__init__(f"[{provider}] 请求 {attempts} 次仍失败：{last_error}")
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶
+
+    参数:
+        rate_per_min (float): 每分钟补充的令牌数，同时也是桶容量
+    """
+
+    def __init__(self, rate_per_min: float):
+        self.capacity = float(rate_per_min)
+        self.rate = rate_per_min / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self, amount: float) -> float:
+        """尝试取出令牌：成功返回 0，否则返回还需等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.rate
+
+    def acquire(self, amount: float = 1.0):
+        """取出 amount 个令牌，不足时阻塞等待（超过容量的请求按容量计）"""
+        amount = min(float(amount), self.capacity)
+        while (wait := self._take(amount)) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, amount: float = 1.0):
+        """acquire 的协程版本，等待期间不阻塞事件循环"""
+        amount = min(float(amount), self.capacity)
+        while (wait := self._take(amount)) > 0:
+            await asyncio.sleep(wait)
+
+
+_buckets = {}  # 服务商 → (rpm 桶, tpm 桶)
+_buckets_lock = threading.Lock()
+
+
+def get_buckets(provider: str):
+    """获取服务商共享的 (rpm, tpm) 令牌桶"""
+    with _buckets_lock:
+        if provider not in _buckets:
+            limits = RATE_LIMITS[provider]
+            _buckets[provider] = (TokenBucket(limits["rpm"]), TokenBucket(limits["tpm"]))
+        return _buckets[provider]
+
+
+def estimate_tokens(texts) -> int:
+    """粗略估算文本（或文本列表）的 token 数，用于 tpm 限流"""
+    if isinstance(texts, str):
+        texts = [texts]
+    return int(sum(len(t) for t in texts) * TOKENS_PER_CHAR) + 1
+
+
+def _status_and_retry_after(error: Exception):
+    """从 openai / requests 异常中取出 HTTP 状态码与 Retry-After（秒）"""
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    retry_after = None
+    headers = getattr(response, "headers", None)
+    if headers:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        try:
+            retry_after = float(value) if value is not None else None
+        except ValueError:
+            retry_after = None
+    return status, retry_after
+
+
+def is_retryable(error: Exception) -> bool:
+    """429、5xx、连接错误与超时可以重试；参数错误、鉴权失败等直接失败"""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    try:
+        import openai
+        if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+            return True
+    except ImportError:
+        pass
+    status, _ = _status_and_retry_after(error)
+    return status in RETRY_STATUS
+
+
+def call_with_retry(provider: str, fn, *args, tokens: int = 0, max_retries: int = MAX_RETRIES, **kwargs):
+    """
+    限流后调用 fn，遇到可重试的错误时退避重试
+
+    参数:
+        provider (str): 服务商名称，见 RATE_LIMITS
+        fn (callable): 实际发起请求的函数；应在失败时抛出异常（requests 响应需先 raise_for_status）
+        tokens (int): 本次请求预计消耗的 token 数（tpm 限流），可用 estimate_tokens 估算
+        max_retries (int): 最大重试次数
+        *args, **kwargs: 传给 fn 的参数
+
+    返回:
+        fn 的返回值
+
+    异常:
+        RetryExhaustedError: 重试用尽仍失败；不可重试的错误原样抛出
+    """
+    rpm_bucket, tpm_bucket = get_buckets(provider)
+    for attempt in range(max_retries + 1):
+        rpm_bucket.acquire(1)
+        if tokens:
+            tpm_bucket.acquire(tokens)
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            time.sleep(_retry_delay(provider, e, attempt, max_retries))
+
+
+async def acall_with_retry(provider: str, fn, *args, tokens: int = 0, max_retries: int = MAX_RETRIES, **kwargs):
+    """
+    call_with_retry 的协程版本：fn 为协程函数（如 AsyncOpenAI 的方法），限流与退避等待均不阻塞事件循环
+    """
+    rpm_bucket, tpm_bucket = get_buckets(provider)
+    for attempt in range(max_retries + 1):
+        await rpm_bucket.acquire_async(1)
+        if tokens:
+            await tpm_bucket.acquire_async(tokens)
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            await asyncio.sleep(_retry_delay(provider, e, attempt, max_retries))
+
+
+def _retry_delay(provider: str, error: Exception, attempt: int, max_retries: int) -> float:
+    """
+    在 except 块内调用：判断是否重试并返回退避时长；不可重试时原样抛出，重试用尽时抛出 RetryExhaustedError
+    """
+    if not is_retryable(error):
+        raise error
+    if attempt == max_retries:
+        raise RetryExhaustedError(provider, attempt + 1, error) from error
+    status, retry_after = _status_and_retry_after(error)
+    if status == 429:
+        get_limiter(provider).record_throttle()  # 通知自适应并发控制器收缩
+    delay = retry_after if retry_after is not None else random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    logger.warning(f"[重试] {provider} 请求失败（{status or type(error).__name__}），{delay:.1f}s 后第 {attempt + 1} 次重试")
+    return delay
+
+
+def post_json(provider: str, url: str, payload: dict, tokens: int = 0, **kwargs) -> dict:
+    """
+    通过共享会话 POST JSON 并返回响应 JSON；非 2xx 响应抛出 HTTPError，按 call_with_retry 规则重试
+    """
+    from utils.api_clients import get_http_session
+
+    def _post():
+        response = get_http_session(provider).post(url, json=payload, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    return call_with_retry(provider, _post, tokens=tokens)
@@ -0,0 +1,165 @@
+# utils/response_cache.py
+"""
+模型响应磁盘缓存（SQLite）
+
+对话补全与 embedding 的结果按 (类型, 服务商, 模型, 提示词, 输入内容哈希, 相关参数) 计算 SHA-256 作为键保存；
+输入不变时重复运行（调整流程代码后重跑入库、对同一目录重新生成调研报告、基准测试）直接读取缓存，不再调用接口，
+结果也可离线复现。提示词或输入文档一旦变化，键随之变化，自然重新生成。
+
+    - 淘汰：超过 MAX_AGE 未被访问的条目删除；总大小超过 MAX_BYTES 时按最久未访问的顺序删除；
+    - 绕过：环境变量 RESPONSE_CACHE_BYPASS=1 或 set_bypass(True) 时不读缓存（结果仍写入，覆盖旧值）。
+
+用法:
+    text = cached(lambda: call_api(...), "chat", "deepseek", "deepseek-chat", messages=messages, temperature=0.5)
+
+    python -m utils.response_cache   # 执行一次淘汰并打印缓存条目数与大小
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from log_init import setup_logger
+from utils.sqlite_store import open_db
+
+logger = setup_logger(__name__)  # 初始化log信息
+
+CACHE_PATH = Path(".cache") / "response_cache.sqlite3"
+MAX_AGE = 90 * 24 * 3600       # 条目最长保留时间（秒，按最后访问时间计）
+MAX_BYTES = 2 * 1024 ** 3      # 缓存总大小上限（字节）
+EVICT_EVERY = 200              # 每写入多少条执行一次淘汰
+
+_bypass = os.getenv("RESPONSE_CACHE_BYPASS", "") == "1"
+_puts = 0
+_puts_lock = threading.Lock()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at);
+"""
+
+
+def _connect():
+    return open_db(CACHE_PATH, _SCHEMA)
+
+
+def set_bypass(flag: bool = True):
+    """开启 / 关闭缓存读取（关闭读取时仍写入新结果）"""
+    global _bypass
+    _bypass = flag
+
+
+def make_key(kind: str, provider: str, model: str, **parts) -> str:
+    """
+    计算缓存键
+
+    参数:
+        kind (str): 请求类型，如 "chat"、"embedding"
+        provider (str): 服务商名称
+        model (str): 模型名称
+        **parts: 影响结果的其他内容（消息列表、提示词、输入文档的 SHA-256、temperature 等），须可 JSON 序列化
+
+    返回:
+        str: 十六进制 SHA-256
+    """
+    payload = json.dumps({"kind": kind, "provider": provider, "model": model, **parts},
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get(key: str) -> Optional[Any]:
+    """读取缓存并刷新访问时间；未命中、已过期或处于绕过模式时返回 None"""
+    if _bypass:
+        return None
+    now = time.time()
+    with _connect() as conn:
+        row = conn.execute("SELECT value FROM responses WHERE key = ? AND accessed_at > ?",
+                           (key, now - MAX_AGE)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+    return json.loads(row[0])
+
+
+def put(key: str, value: Any):
+    """写入缓存（覆盖同键旧值），每 EVICT_EVERY 次写入触发一次淘汰"""
+    global _puts
+    text = json.dumps(value, ensure_ascii=False)
+    now = time.time()
+    with _connect() as conn:
+        conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                     (key, text, len(text.encode("utf-8")), now, now))
+    with _puts_lock:
+        _puts += 1
+        due = _puts % EVICT_EVERY == 0
+    if due:
+        evict()
+
+
+def cached(compute: Callable[[], Any], kind: str, provider: str, model: str, **parts) -> Any:
+    """
+    读穿缓存：命中时直接返回缓存结果，否则调用 compute() 并写入缓存
+
+    参数:
+        compute (callable): 无参函数，发起实际请求并返回可 JSON 序列化的结果
+        kind, provider, model, **parts: 见 make_key
+
+    返回:
+        compute() 的结果（或其缓存）
+    """
+    key = make_key(kind, provider, model, **parts)
+    value = get(key)
+    if value is not None:
+        logger.debug(f"[缓存] 命中 {kind} {provider}/{model}")
+        return value
+    value = compute()
+    put(key, value)
+    return value
+
+
+def evict(max_age: float = MAX_AGE, max_bytes: int = MAX_BYTES) -> int:
+    """
+    淘汰过期条目，并在总大小超限时按最久未访问的顺序删除
+
+    返回:
+        int: 删除的条目数
+    """
+    with _connect() as conn:
+        removed = conn.execute("DELETE FROM responses WHERE accessed_at <= ?", (time.time() - max_age,)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > max_bytes:
+            excess = total - max_bytes
+            victims = []
+            for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+                victims.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+            removed += len(victims)
+    if removed:
+        logger.info(f"[缓存] 淘汰 {removed} 条响应缓存")
+    return removed
+
+
+def stats() -> dict:
+    """返回 {"entries": 条目数, "bytes": 总大小}"""
+    with _connect() as conn:
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+    return {"entries": entries, "bytes": size}
+
+
+if __name__ == "__main__":
+    removed = evict()
+    s = stats()
+    print(f"\n🗄️ 响应缓存：{s['entries']} 条，{s['bytes'] / 1024 ** 2:.1f} MB（本次淘汰 {removed} 条）\n")
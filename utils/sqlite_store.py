@@ -0,0 +1,41 @@
+# utils/sqlite_store.py
+"""
+本地 SQLite 状态库的公共连接方法（file_registry、job_ledger、response_cache、embedding_cache、ocr_cache 使用）
+"""
+
+import sqlite3
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+_init_lock = threading.Lock()
+_initialized = set()
+
+
+@contextmanager
+def open_db(db_path: Path, schema: str):
+    """
+    打开 SQLite 连接：首次使用时创建目录、启用 WAL 并执行建表语句；退出时提交并关闭
+
+    每次调用新建连接（sqlite3 连接不宜跨线程共享），多线程 / 多进程并发写入由 SQLite 锁与 timeout 协调。
+
+    参数:
+        db_path (Path): 数据库文件路径
+        schema (str): 建表语句（CREATE TABLE IF NOT EXISTS ...，可含多条）
+    """
+    db_path = Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    key = str(db_path.resolve())
+    if key not in _initialized:
+        with _init_lock:
+            if key not in _initialized:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(schema)
+                conn.commit()
+                _initialized.add(key)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()